@@ -1,4 +1,58 @@
-from .puzzle_pdf import create_pdf
-from .draw_game.diagram import make_diagram
-from .collection_info import get_num_stones_for_selections
-from .board_templates import create_blank_template, create_portable_board
+import importlib
+
+# the modules of the package's functions, which are only imported
+# once one of their functions is first used, so importing tsumego_pdf
+# doesn't load NumPy, Pillow, ReportLab or multiprocessing.
+_LAZY_ATTRS = {
+    "Renderer": ".puzzle_pdf",
+    "create_pdf": ".puzzle_pdf",
+    "make_diagram": ".draw_game.diagram",
+    "make_diagrams": ".draw_game.diagram",
+    "DiagramCache": ".draw_game.diagram_cache",
+    "get_num_stones_for_selections": ".collection_info",
+    "create_blank_template": ".board_templates",
+    "create_portable_board": ".board_templates",
+    "make_diagram_svg": ".svg_export",
+}
+
+# the package's submodules, which are likewise imported once they're used,
+# so tsumego_pdf.puzzle_pdf and the like work after a plain import tsumego_pdf.
+_LAZY_SUBMODULES = (
+    "board_templates",
+    "collection_info",
+    "draw_game",
+    "job_events",
+    "memory",
+    "page_stream",
+    "pdf_images",
+    "pdf_layers",
+    "pdf_pages",
+    "pdf_sprites",
+    "pdf_vector",
+    "puzzle_pdf",
+    "puzzles",
+    "svg_export",
+    "trace",
+    "workers",
+    "write_pdf",
+)
+
+__all__ = list(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        # importing a submodule also sets it as an attribute of the package.
+        return importlib.import_module(f".{name}", __name__)
+
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value  # so it's only looked up once.
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_LAZY_SUBMODULES))
@@ -1,10 +1,14 @@
-import os
-import tempfile
 import numpy as np
 from PIL import Image, ImageDraw
 import reportlab.lib.pagesizes
 from reportlab.pdfgen import canvas
-from .draw_game.board_graphics import DPI, BOARD_PADDING_PX, LINE_COLOR, draw_board
+from .draw_game.board_graphics import (
+    DPI,
+    BOARD_PADDING_PX,
+    LINE_COLOR,
+    draw_board,
+)
+from .pdf_images import draw_image, encode_image
 
 
 def create_blank_template(
@@ -103,11 +107,9 @@ def create_blank_template(
     """
     Step 2) Creates PDF.
     """
-    # saves page to a temp file.
-    with tempfile.NamedTemporaryFile(suffix=".png") as temp_file:
-        temp_path = temp_file.name
-
-    page.save(temp_path)
+    # the page is compressed in memory and embedded once however many
+    # times it's repeated.
+    encoded_page = encode_image(page)
 
     # opens PDF writer.
     out_pdf = canvas.Canvas(out_path, pagesize=paper_size)
@@ -120,13 +122,11 @@ def create_blank_template(
     out_h = img_h * scale
 
     for _ in range(num_pages):
-        out_pdf.drawImage(temp_path, 0, 0, width=out_w, height=out_h)
+        draw_image(out_pdf, encoded_page, 0, 0, width=out_w, height=out_h)
         out_pdf.showPage()
 
     out_pdf.save()
 
-    os.remove(temp_path)
-
     print(
         f"A PDF of blank {board_width}x{board_height} "
         f'Go boards has been saved to "{out_path}".'
@@ -351,18 +351,18 @@ def create_portable_board(
     paste_coords = [(int(x), int(y)) for x, y in paste_coords]
 
     """
-    Step 4) Pastes the board and saves the page images.
+    Step 4) Pastes the board and compresses the page images in memory.
     """
-    temp_paths = []
-    for paste_x, paste_y in paste_coords:
-        page = Image.new("RGB", (img_w, img_h), (255, 255, 255))
+    # one page image is cleared and reused for every page,
+    # since each is compressed before the next is pasted.
+    page = Image.new("RGB", (img_w, img_h), "white")
+    encoded_pages = []
+    for i, (paste_x, paste_y) in enumerate(paste_coords):
+        if i > 0:
+            page.paste("white", (0, 0, img_w, img_h))
         page.paste(board, (paste_x, paste_y))
-
-        with tempfile.NamedTemporaryFile(suffix=".png") as temp_file:
-            temp_path = temp_file.name
-
-        page.save(temp_path)
-        temp_paths.append(temp_path)
+        encoded_pages.append(encode_image(page))
+    del page  # it isn't needed while the PDF is written.
 
     """
     Step 5) Creates and saves the PDF.
@@ -377,16 +377,13 @@ def create_portable_board(
     out_w = img_w * scale
     out_h = img_h * scale
 
-    for i, temp_path in enumerate(temp_paths):
-        out_pdf.drawImage(temp_path, 0, 0, width=out_w, height=out_h)
-        if i < len(temp_paths) - 1:
+    for i, encoded_page in enumerate(encoded_pages):
+        draw_image(out_pdf, encoded_page, 0, 0, width=out_w, height=out_h)
+        if i < len(encoded_pages) - 1:
             out_pdf.showPage()
 
     out_pdf.save()
 
-    for temp_path in temp_paths:
-        os.remove(temp_path)
-
     print(
         f"A printable {board_width}x{board_height} "
         f'Go board has been saved to "{out_path}".'
@@ -6,6 +6,7 @@ graphical components for the drawing of diagrams.
 """
 
 import os
+import threading
 from PIL import Image, ImageDraw, ImageFont
 from tsumego_pdf.puzzles.playout import STONE_TO_NUM, BLACK_STONES, WHITE_STONES
 
@@ -17,6 +18,10 @@ TEXT_PADDING_TOP_IN = 1 / 16
 TEXT_PADDING_BOTTOM_IN = 0
 BOARD_PADDING_PX = 2
 
+# the graphics below are shared by every thread of a process, so they're
+# only loaded while this is held. once loaded, they're never changed.
+GRAPHICS_LOCK = threading.RLock()
+
 _STONE_OUTLINE_COLOR = (0, 0, 0)
 _BLACK_STONE_COLOR = (0, 0, 0)
 _WHITE_STONE_COLOR = (255, 255, 255)
@@ -24,6 +29,55 @@ _BOARD_COLOR = (255, 255, 255)
 
 _GRAPHIC_PADDING_PX = 6
 
+# the color modes pages can be rendered in:
+# "RGB", "L" (8-bit grayscale) or "1" (1-bit black and white).
+COLOR_MODES = ("RGB", "L", "1")
+_BILEVEL_THRESHOLD = 224  # grays darker than this become black in "1" mode.
+
+
+def drawing_mode(color_mode: str):
+    """
+    Returns the PIL mode graphics are drawn in for the given color mode.
+    1-bit images are drawn in grayscale first, so that
+    antialiased edges can be thresholded once at the end.
+    """
+    if color_mode not in COLOR_MODES:
+        raise ValueError(
+            f'"{color_mode}" is not a color mode. Use one of: {", ".join(COLOR_MODES)}'
+        )
+    return "RGB" if color_mode == "RGB" else "L"
+
+
+def convert_to_color_mode(image, color_mode: str):
+    """Returns the image converted to the given color mode."""
+    if image.mode == color_mode:
+        return image
+
+    if color_mode == "1":
+        # every gray is either pushed to black or white
+        # instead of being dithered.
+        return image.convert("L").point(
+            lambda v: 255 if v >= _BILEVEL_THRESHOLD else 0, mode="1"
+        )
+
+    return image.convert(color_mode)
+
+
+def color_in_mode(rgb: tuple, color_mode: str):
+    """Returns the RGB color as it looks once converted to the given color mode."""
+    if color_mode == "RGB":
+        return tuple(rgb[:3])
+
+    pixel = Image.new("RGB", (1, 1), tuple(rgb[:3]))
+    return convert_to_color_mode(pixel, color_mode).convert("RGB").getpixel((0, 0))
+
+
+def _to_ink(rgb: tuple, mode: str):
+    """Returns the RGB color as the ink value ImageDraw expects for the mode."""
+    if mode == "RGB":
+        return rgb
+    return Image.new("RGB", (1, 1), rgb[:3]).convert("L").getpixel((0, 0))
+
 
 def _create_stone_graphic(stone_size_px, is_black: bool, outline_thickness_in):
     """Returns a PIL image with the stone graphic inside."""
@@ -70,31 +124,52 @@ def _create_stone_graphic(stone_size_px, is_black: bool, outline_thickness_in):
     )
 
 
-def _create_star_point_graphic(
-    cell_width_px, cell_height_px, star_point_radius_in, fill_color=(0, 0, 0, 255)
-):
-    SCALE = 4
-    result = Image.new(
-        "RGBA",
-        (cell_width_px * SCALE, cell_height_px * SCALE),
-        (255, 255, 255, 0),
-    )
-    draw = ImageDraw.Draw(result)
+def get_star_points(board_width: int, board_height: int):
+    """Returns the (x, y) board coords of the star points for a board size."""
+    if board_width % 2 == 1 and board_width >= 9:
+        center_point_x = board_width // 2
+    else:
+        center_point_x = None
+
+    if board_height % 2 == 1 and board_height >= 9:
+        center_point_y = board_height // 2
+    else:
+        center_point_y = None
 
-    radius = star_point_radius_in * DPI * SCALE
-    left = int(result.size[0] / 2 - radius)
-    top = int(result.size[1] / 2 - radius)
-    right = int(result.size[0] / 2 + radius)
-    bottom = int(result.size[1] / 2 + radius)
+    x_horiz_star_coords = []
+    y_horiz_star_coords = []
 
-    bbox = (left, top, right, bottom)
-    draw.ellipse(bbox, fill=fill_color)
+    if board_width >= 17 and center_point_x is not None:
+        x_horiz_star_coords.append(center_point_x)
 
-    return result.resize((cell_width_px, cell_height_px), resample=Image.LANCZOS)
+    if board_height >= 17 and center_point_y is not None:
+        y_horiz_star_coords.append(center_point_y)
+
+    if board_width >= 12:
+        x_horiz_star_coords.extend([3, board_width - 4])
+
+    if board_height >= 12:
+        y_horiz_star_coords.extend([3, board_height - 4])
 
+    star_points = []
 
-_STAR_POINT_GRAPHIC = None
-_LAST_CELL_SIZE = None
+    if center_point_x is not None and center_point_y is not None:
+        star_points.append((center_point_x, center_point_y))
+
+    for star_x in x_horiz_star_coords:
+        for star_y in y_horiz_star_coords:
+            star_points.append((star_x, star_y))
+
+    return star_points
+
+
+def star_point_radius(stone_size_px, star_point_radius_in=None):
+    """Returns the star point radius in inches used for the given stone size."""
+    if star_point_radius_in is not None:
+        return star_point_radius_in
+
+    ratio = (3 / 32) / 0.878  # star point radius : stone size
+    return stone_size_px * ratio / DPI
 
 
 def draw_board(
@@ -106,9 +181,9 @@ def draw_board(
     y_scale=1.0,
     fill_color=LINE_COLOR,
     star_points=None,
+    mode: str = "RGB",
 ):
-    """Returns a drawn Go board."""
-    global _STAR_POINT_GRAPHIC, _LAST_CELL_SIZE, _LAST_FACTOR
+    """Returns a drawn Go board in the given PIL mode ("RGB" or "L")."""
     ANTIALIAS_SIZE = 128
     OFF = BOARD_PADDING_PX
 
@@ -118,8 +193,8 @@ def draw_board(
     ratio = (3 / 32) / 0.878  # star point radius : stone size
     if stone_size_px is None and star_point_radius_in is None:
         star_point_radius_in = (width_in / board_width) * ratio
-    elif star_point_radius_in is None:
-        star_point_radius_in = stone_size_px * ratio / DPI
+    else:
+        star_point_radius_in = star_point_radius(stone_size_px, star_point_radius_in)
 
     # determines board width and height.
     if isinstance(board_size, tuple):
@@ -144,7 +219,8 @@ def draw_board(
         img_width = cell_width_px * board_width + OFF * 2
         img_height = cell_height_px * board_height + OFF * 2
 
-    image = Image.new("RGB", (img_width, img_height), _BOARD_COLOR)
+    image = Image.new(mode, (img_width, img_height), _to_ink(_BOARD_COLOR, mode))
+    line_ink = _to_ink(fill_color, mode)
 
     """
     Step 2) Draws lines.
@@ -161,7 +237,7 @@ def draw_board(
         a = (draw_x, top_y - line_width // 2 + 1)
         b = (draw_x, bottom_y + line_width // 2 - 1)
 
-        draw.line([a, b], fill=fill_color, width=line_width)
+        draw.line([a, b], fill=line_ink, width=line_width)
 
     # draws the horizontal lines.
     start_y = top_y
@@ -171,68 +247,15 @@ def draw_board(
         draw_y = start_y + y * cell_height_px
         a = (left_x - line_width // 2 + 1, draw_y)
         b = (right_x + line_width // 2 - 1, draw_y)
-        draw.line([a, b], fill=fill_color, width=line_width)
+        draw.line([a, b], fill=line_ink, width=line_width)
 
     """
-    Step 3) Creates the star point image.
-    """
-    if line_width % 2 == 1:
-        star_point_size = cell_width_px + (1 - (cell_width_px % 2))
-        px_offset = 0
-    else:
-        star_point_size = cell_width_px + (cell_width_px % 2)
-        px_offset = 1 - cell_width_px % 2
-
-    if _STAR_POINT_GRAPHIC is None or _STAR_POINT_GRAPHIC.size[0] != star_point_size:
-        _STAR_POINT_GRAPHIC = _create_star_point_graphic(
-            cell_width_px,
-            cell_height_px,
-            star_point_radius_in=star_point_radius_in,
-            fill_color=fill_color,
-        )
-
-    """
-    Step 4) Determines the board coords for the star points.
+    Step 3) Determines the board coords for the star points.
     """
     radius_px = int(star_point_radius_in * DPI)
 
-    x_horiz_star_coords = []
-    y_vertical_star_coords = []
-
-    if board_width % 2 == 1 and board_width >= 9:
-        center_point_x = board_width // 2
-    else:
-        center_point_x = None
-
-    if board_height % 2 == 1 and board_height >= 9:
-        center_point_y = board_height // 2
-    else:
-        center_point_y = None
-
-    x_horiz_star_coords = []
-    y_horiz_star_coords = []
-
-    if board_width >= 17 and center_point_x is not None:
-        x_horiz_star_coords.append(center_point_x)
-
-    if board_height >= 17 and center_point_y is not None:
-        y_horiz_star_coords.append(center_point_y)
-
-    if board_width >= 12:
-        x_horiz_star_coords.extend([3, board_width - 4])
-
-    if board_height >= 12:
-        y_horiz_star_coords.extend([3, board_height - 4])
-
     if star_points is None:
-        star_points = []
-
-        if center_point_x is not None and center_point_y is not None:
-            star_points.append((center_point_x, center_point_y))
-
-        for star_x in x_horiz_star_coords:
-            for star_y in y_horiz_star_coords:
-                star_points.append((star_x, star_y))
+        star_points = get_star_points(board_width, board_height)
 
     SCALE = 4
     if cell_width_px >= ANTIALIAS_SIZE:
@@ -268,7 +291,11 @@ def draw_board(
             draw.ellipse(bbox, fill=fill_color)
 
         comp = comp.resize((img_width, img_height), Image.Resampling.LANCZOS)
-        image = Image.alpha_composite(image, comp)
+
+        # the star points are blended on with their alpha,
+        # which works for boards without an alpha channel of their own.
+        image.paste(comp, (0, 0), mask=comp)
+        draw = ImageDraw.Draw(image)
     else:
         # draws star points without antialiasing.
         for x, y in star_points:
@@ -295,7 +322,7 @@ def draw_board(
                 p_y + r + (l + 1) % 2,
             )
 
-            draw.ellipse(bbox, fill=fill_color)
+            draw.ellipse(bbox, fill=line_ink)
 
     return image, draw
 
@@ -314,10 +341,56 @@ def _load_mark_image(stone_size_px, is_black: bool, solution_mark: str):
     return graphic.resize(new_size, Image.Resampling.LANCZOS)
 
 
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "res", "font.ttf")
+NUMS_FONT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "res", "nums.ttf"
+)
+
 _FONT = None
 _NUMS_FONT = None
 
 
+def load_fonts():
+    """Loads the fonts if that hasn't been done yet."""
+    global _FONT, _NUMS_FONT
+    if _NUMS_FONT is not None:
+        return
+
+    with GRAPHICS_LOCK:
+        if _NUMS_FONT is None:
+            _FONT = ImageFont.truetype(FONT_PATH, size=DPI / 4)
+            _NUMS_FONT = ImageFont.truetype(NUMS_FONT_PATH, size=DPI / 4)
+
+
+def measure_text(text: str, text_height_in=0.21, is_num: bool = False):
+    """
+    Returns where create_text_image(...) puts the text inside its image
+    as (width_px, height_px, font_size_px, origin_x_px, baseline_y_px),
+    so the same text can be typeset as real text instead of pasted as pixels.
+    """
+    load_fonts()
+    draw_font = _NUMS_FONT if is_num else _FONT
+
+    left, top, right, bottom = draw_font.getbbox(text)
+    top, bottom = top - 10, bottom + 10  # pads.
+    w, h = right - left, bottom - top
+
+    if w == 0:
+        return (10, 10, 0, 0, 0)
+
+    height_px = text_height_in * DPI
+    scale = height_px / h
+    ascent = draw_font.getmetrics()[0]
+
+    return (
+        int(height_px * w / h),
+        int(height_px),
+        draw_font.size * scale,
+        -left * scale,
+        (ascent - top) * scale,
+    )
+
+
 def create_text_image(
     text: str,
     rgb_fill: tuple,
@@ -326,15 +399,7 @@ def create_text_image(
     is_num: bool = False,
 ):
     """Returns an image with text drawn inside."""
-    # loads font if it hasn't been done yet.
-    global _FONT, _NUMS_FONT
-    if _FONT is None:
-        # loads font.
-        local_dir = os.path.dirname(os.path.abspath(__file__))
-        font_path = os.path.join(local_dir, "res", "font.ttf")
-        nums_font_path = os.path.join(local_dir, "res", "nums.ttf")
-        _FONT = ImageFont.truetype(font_path, size=DPI / 4)
-        _NUMS_FONT = ImageFont.truetype(nums_font_path, size=DPI / 4)
+    load_fonts()
 
     # determines the bbox that the drawn text will have.
     if transparent:
@@ -369,19 +434,18 @@ def create_text_image(
     )
 
 
-_NUMBERS = None
-_INSIDE_NUMBERS_DARK = None  # inside white stone.
-_INSIDE_NUMBERS_LIGHT = None  # inside black stone.
-
 _circle = None
 
 
 def _create_stone_numbers_for_key(stone_size_px):
-    global _NUMBERS, _INSIDE_NUMBERS_DARK, _INSIDE_NUMBERS_LIGHT
-
-    _NUMBERS = []
-    _INSIDE_NUMBERS_DARK = []
-    _INSIDE_NUMBERS_LIGHT = []
+    """
+    Returns (numbers, inside_numbers_dark, inside_numbers_light)
+    with the key's numbers drawn on their own, inside white stones
+    and inside black stones.
+    """
+    numbers = []
+    inside_numbers_dark = []  # inside white stone.
+    inside_numbers_light = []  # inside black stone.
 
     DARK_RGB = (0, 0, 0)
     LIGHT_RGB = (255, 255, 255)
@@ -448,46 +512,103 @@ def _create_stone_numbers_for_key(stone_size_px):
         return result
 
     for i in range(MAX_NUM):
-        _NUMBERS.append(make_num(i, DARK_RGB, scaled, add_circle=True))
-        _INSIDE_NUMBERS_DARK.append(make_num(i, DARK_RGB, scaled))
-        _INSIDE_NUMBERS_LIGHT.append(make_num(i, LIGHT_RGB, scaled))
+        numbers.append(make_num(i, DARK_RGB, scaled, add_circle=True))
+        inside_numbers_dark.append(make_num(i, DARK_RGB, scaled))
+        inside_numbers_light.append(make_num(i, LIGHT_RGB, scaled))
+
+    return numbers, inside_numbers_dark, inside_numbers_light
 
 
-_BLACK_STONE_IMAGE = None
-_WHITE_STONE_IMAGE = None
+# the stone, mark and number graphics by the style they were made for,
+# so a thread drawing in one style never sees those of another.
+_STONE_GRAPHICS = {}
+_MAX_STONE_STYLES = 4
+_local = threading.local()  # the graphics each thread is drawing with.
 
-_SOLUTION_MARK = None
-_SOLUTION_BLACK_IMAGE = None
-_SOLUTION_WHITE_IMAGE = None
 
+def _convert_graphic(graphic, mode: str):
+    """Returns the RGBA graphic with its alpha kept for the given drawing mode."""
+    return graphic if mode == "RGB" else graphic.convert("LA")
 
-def refresh_stone_graphics(stone_size_px, solution_mark: str, outline_thickness_in):
-    # loads stone graphics if they haven't been loaded yet.
-    global _BLACK_STONE_IMAGE, _WHITE_STONE_IMAGE
-    global _SOLUTION_MARK, _SOLUTION_BLACK_IMAGE, _SOLUTION_WHITE_IMAGE
-    if _BLACK_STONE_IMAGE is None or _BLACK_STONE_IMAGE.size[0] != stone_size_px:
-        _BLACK_STONE_IMAGE = _create_stone_graphic(
+
+def _create_stone_graphics(
+    stone_size_px, solution_mark: str, outline_thickness_in, mode: str
+):
+    """Returns the stone, mark and number graphics of a style by their names."""
+    # the stone graphics are padded, so their size isn't the stone size.
+    numbers, inside_numbers_dark, inside_numbers_light = (
+        _create_stone_numbers_for_key(stone_size_px)
+    )
+    graphics = {
+        "black-stone": _create_stone_graphic(
             stone_size_px,
             is_black=True,
             outline_thickness_in=outline_thickness_in,
-        )
-        _WHITE_STONE_IMAGE = _create_stone_graphic(
+        ),
+        "white-stone": _create_stone_graphic(
             stone_size_px,
             is_black=False,
             outline_thickness_in=outline_thickness_in,
-        )
-        _create_stone_numbers_for_key(stone_size_px)
-
-    if (
-        _SOLUTION_MARK != solution_mark
-        or _SOLUTION_BLACK_IMAGE.size[0] != stone_size_px
-    ):
-        _SOLUTION_BLACK_IMAGE = _load_mark_image(
+        ),
+        "black-mark": _load_mark_image(
             stone_size_px, is_black=True, solution_mark=solution_mark
-        )
-        _SOLUTION_WHITE_IMAGE = _load_mark_image(
+        ),
+        "white-mark": _load_mark_image(
             stone_size_px, is_black=False, solution_mark=solution_mark
-        )
+        ),
+    }
+    graphics = {name: _convert_graphic(g, mode) for name, g in graphics.items()}
+    graphics["numbers"] = [_convert_graphic(n, mode) for n in numbers]
+    graphics["inside-numbers-dark"] = [
+        _convert_graphic(n, mode) for n in inside_numbers_dark
+    ]
+    graphics["inside-numbers-light"] = [
+        _convert_graphic(n, mode) for n in inside_numbers_light
+    ]
+    return graphics
+
+
+def refresh_stone_graphics(
+    stone_size_px, solution_mark: str, outline_thickness_in, mode: str = "RGB"
+):
+    """
+    Loads the stone, mark and number graphics of the style if they aren't,
+    and has the calling thread draw with them from then on.
+    """
+    style = (stone_size_px, solution_mark, outline_thickness_in, mode)
+    with GRAPHICS_LOCK:
+        graphics = _STONE_GRAPHICS.get(style)
+        if graphics is None:
+            if len(_STONE_GRAPHICS) >= _MAX_STONE_STYLES:
+                # the oldest style is let go of, though any thread
+                # still drawing with it keeps its graphics until it's done.
+                del _STONE_GRAPHICS[next(iter(_STONE_GRAPHICS))]
+            graphics = _create_stone_graphics(*style)
+            _STONE_GRAPHICS[style] = graphics
+
+    _local.stone_graphics = graphics
+
+
+def get_sprite(name: str, char: str = None):
+    """
+    Returns one of the graphics the calling thread last loaded
+    with refresh_stone_graphics(...), which are centered on a stone-sized cell when they're drawn.
+
+    Parameters:
+        name (str): the graphic to get:
+                    - "black-stone" or "white-stone"
+                    - "black-mark" or "white-mark"
+                    - "number": a key number (given by char) from the playout.
+    """
+    graphics = _local.stone_graphics
+    if name != "number":
+        return graphics[name]
+
+    if char in "123456789":
+        return graphics["numbers"][int(char)]
+    elif char in BLACK_STONES:
+        return graphics["inside-numbers-light"][STONE_TO_NUM[char]]
+    return graphics["inside-numbers-dark"][STONE_TO_NUM[char]]
 
 
 def draw_stone(board, x, y, stone_size_px, is_black: bool, outline_thickness_in):
@@ -495,7 +616,7 @@ def draw_stone(board, x, y, stone_size_px, is_black: bool, outline_thickness_in)
     OFF = BOARD_PADDING_PX
     draw_x = int(x * stone_size_px) - _GRAPHIC_PADDING_PX + OFF
     draw_y = int(y * stone_size_px) - _GRAPHIC_PADDING_PX + OFF
-    img = _BLACK_STONE_IMAGE if is_black else _WHITE_STONE_IMAGE
+    img = get_sprite("black-stone" if is_black else "white-stone")
     board.paste(img, (draw_x, draw_y), mask=img)
 
 
@@ -534,7 +655,7 @@ def draw_mark(board, x, y, stone_size_px, is_black: bool):
     OFF = BOARD_PADDING_PX
     draw_x = int(x * stone_size_px) + OFF
     draw_y = int(y * stone_size_px) + OFF
-    img = _SOLUTION_BLACK_IMAGE if is_black else _SOLUTION_WHITE_IMAGE
+    img = get_sprite("black-mark" if is_black else "white-mark")
     board.paste(img, (draw_x, draw_y), mask=img)
 
 
@@ -542,12 +663,5 @@ def draw_key_number(board, x, y, stone_size_px, char: str):
     OFF = BOARD_PADDING_PX
     draw_x = int(x * stone_size_px) + OFF
     draw_y = int(y * stone_size_px) + OFF
-
-    if char in "123456789":
-        img = _NUMBERS[int(char)]
-    elif char in BLACK_STONES:
-        img = _INSIDE_NUMBERS_LIGHT[STONE_TO_NUM[char]]
-    else:
-        img = _INSIDE_NUMBERS_DARK[STONE_TO_NUM[char]]
-
+    img = get_sprite("number", char)
     board.paste(img, (draw_x, draw_y), mask=img)
@@ -5,17 +5,26 @@ This file contains functionality to draw a tsumego diagram
 with or without the solution(s) marked.
 """
 
+import copy
+import io
 import json
-import os
+import multiprocessing
 import random
+from functools import partial
 from PIL import Image, ImageDraw
 from tsumego_pdf.puzzles.problems_json import (
     GOKYO_SHUMYO_SECTIONS,
     get_problem,
+    get_problems,
 )
 from tsumego_pdf.puzzles.playout import BLACK_STONES, WHITE_STONES
+from tsumego_pdf.workers import available_cpus
 from .board_graphics import *
 
+# bump this whenever a change alters how diagrams look,
+# so that any diagrams cached on disk are no longer used.
+RENDERER_VERSION = 2
+
 
 def calc_stone_size(diagram_width_in, display_width):
     """
@@ -29,7 +38,82 @@ def calc_stone_size(diagram_width_in, display_width):
     return int(stone_size_px)
 
 
-def make_diagram(
+def make_point_transform(
+    board_width: int,
+    board_height: int,
+    flip_xy: bool,
+    flip_x: bool,
+    flip_y: bool,
+):
+    """
+    Returns a function which maps a board coordinate of the problem
+    to where it lands once the problem is flipped,
+    along with the (width, height) of the flipped board.
+
+    The board is first reflected across its diagonal (flip_xy),
+    then across the X-axis (flip_x) and then across the Y-axis (flip_y).
+    """
+    if flip_xy:
+        out_width, out_height = board_height, board_width
+    else:
+        out_width, out_height = board_width, board_height
+
+    def transform(x, y):
+        if flip_xy:
+            x, y = y, x
+        if flip_x:
+            y = out_height - 1 - y
+        if flip_y:
+            x = out_width - 1 - x
+        return x, y
+
+    return transform, (out_width, out_height)
+
+
+class DiagramLayout:
+    def __init__(
+        self,
+        stone_size_px: int,
+        board_size: tuple,
+        crop_box: tuple,
+        size: tuple,
+        line_width_in,
+        star_point_radius_in,
+        outline_thickness_in,
+        solution_mark: str,
+        text_rgb: tuple,
+        color_mode: str,
+    ):
+        """
+        Everything needed to draw one diagram once its problem
+        has been flipped, cropped and labeled.
+
+        Board coords are relative to the full flipped board,
+        whereas pixel positions are at DPI and relative to
+        the top-left corner of the full board image before it's cropped
+        (except for the labels, which are relative to the diagram itself).
+        """
+        self.stone_size_px = stone_size_px
+        self.board_size = board_size  # (width, height) in stones.
+        self.crop_box = crop_box  # (left, top, right, bottom) in pixels.
+        self.size = size  # (width, height) of the finished diagram in pixels.
+        self.line_width_in = line_width_in
+        self.star_point_radius_in = star_point_radius_in
+        self.outline_thickness_in = outline_thickness_in
+        self.solution_mark = solution_mark
+        self.text_rgb = text_rgb
+        self.color_mode = color_mode
+
+        self.star_points = get_star_points(*board_size)
+        self.stones = []  # (x, y, is_black), in the order they're drawn.
+        self.marks = []  # (x, y, is_black).
+        self.numbers = []  # (x, y, char).
+        self.labels = []  # (text, x_px, y_px, text_height_in).
+
+        self.cache_params = None  # what the diagram cache key is made from.
+
+
+def layout_diagram(
     diagram_width_in,
     problem_num: int = None,
     collection_name: str = None,
@@ -55,61 +139,12 @@ def make_diagram(
     line_width_in=1 / 96,
     star_point_radius_in=None,
     ratio_to_flip_xy=5 / 6,
+    color_mode: str = "RGB",
 ):
     """
-    Returns a PIL Image of a Life and Death diagram for the desired problem.
-
-    Parameters:
-        diagram_width_in (num): the output diagram width in inches.
-        problem_num (int): the problem number.
-        collection_name (str): the name of the collection to use.
-            - "cho-elementary"
-            - "cho-intermediate"
-            - "cho-advanced"
-            - "gokyo-shumyo"
-            - "xuanxuan-qijing"
-            - "igo-hatsuyoron"
-        section_name (str): the name of the section to use.
-                            for any collection other than the Gokyo Shumyo
-                            this will be None.
-        latex_str (str): overrides the problem selection process and just
-                         makes a diagram of the LaTeX given directly.
-                         None by default.
-        color_to_play (str):
-            - "default": keeps stone colors as they are in the original data.
-            - "black": forces the player to move to be black.
-            - "white": forces the player to move to be white.
-            - "random": forces the player to move to be random.
-        is_random_color (bool): True if the color was gotten through randomization.
-                                Don't worry about this if color_to_play is "random".
-        flip_xy (bool): if True, problem has its X/Y axes flipped.
-        flip_x (bool): if True, problem is flipped across X-axis.
-        flip_y (bool): if True, problem is flipped across Y-axis.
-        include_text (bool): if True, a problem label
-                             will be added to the diagram.
-        show_problem_num (bool): if True, the problem number will be shown on the worksheet.
-                                 the number is always shown on the key no matter what.
-        force_color_to_play (bool): if True, the label "black/white to play"
-                                    is shown no matter what.
-        create_key (bool): if True, the problem solution(s) is/are marked.
-        draw_sole_solving_stone (bool): if True, a stone will be drawn
-                                        before the solution marker is drawn
-                                        on top of the image, but only if the
-                                        puzzle has one single solution alone.
-        solution_mark (str): the name of the image marker to use:
-                             - "x"
-                             - "star"
-        text_rgb (tuple): the RGB for the label below the diagram.
-        text_height_in (num): the height of the label text.
-        display_width (int): the maximum width of the board displayed.
-                             12 is a good value for Cho's problems.
-        write_collection_label (bool): if True, the collection name is shown.
-        line_width_in (num): the width in inches of the board lines.
-        star_point_radius_in (num): the radius of the star points in inches.
-        ratio_to_flip_xy (num): the ratio a puzzle must fall within
-                                to have its X/Y axes considered possibly randomly flipped.
-                                5/6 assumes the bbox of the puzzle's side lengths have a ratio
-                                that falls between 5/6 and 6/5.
+    Returns a DiagramLayout of a Life and Death diagram for the desired problem,
+    which says where everything goes without drawing anything.
+    The parameters are the same as make_diagram(...).
     """
 
     """
@@ -117,31 +152,13 @@ def make_diagram(
     """
     # determine the stone size.
     stone_size_px = calc_stone_size(diagram_width_in, display_width)
-    refresh_stone_graphics(stone_size_px, solution_mark, outline_thickness_in)
+    drawing_mode(color_mode)  # raises an error if the color mode is unknown.
 
     # determines color to play.
     if color_to_play == "random":
         is_random_color = True
         color_to_play = random.choice(["black", "white"])
 
-    # draws a full board.
-    full_board_width_in = ((stone_size_px * 19) - BOARD_PADDING_PX * 2) / DPI
-    board, board_draw = draw_board(
-        stone_size_px=stone_size_px,
-        line_width_in=line_width_in,
-        star_point_radius_in=star_point_radius_in,
-    )
-
-    if ratio_to_flip_xy < 1:
-        min_ratio_to_flip_xy = ratio_to_flip_xy
-        max_ratio_to_flip_xy = 1 / ratio_to_flip_xy
-    else:
-        min_ratio_to_flip_xy = 1 / ratio_to_flip_xy
-        max_ratio_to_flip_xy = ratio_to_flip_xy
-
-    """
-    Step 2) Get problem info.
-    """
     if not create_key:
         play_out_solution = False
 
@@ -152,90 +169,65 @@ def make_diagram(
         latex_str,
         play_out_solution=play_out_solution,
     )
+
+    """
+    Step 2) Get problem info.
+    """
     lines = problem_dict["lines"]
     default_to_play = problem_dict["default-to-play"]
     max_x = problem_dict["show-width"] - 1
     max_y = problem_dict["show-height"] - 1
 
-    """
-    Step 3) Draws stones and determines the bounding box of the stones.
-    """
-    invert_colors = color_to_play != "default" and default_to_play != color_to_play
-    NUM_CHARS = "123456789" + BLACK_STONES[1:] + WHITE_STONES[1:]
-
-    marks = []
-    solution_nums = []
-    for y, line in enumerate(lines):
-        for x, c in enumerate(line):
-            if c in BLACK_STONES:  # black stone.
-                draw_stone(
-                    board,
-                    x,
-                    y,
-                    stone_size_px,
-                    is_black=not invert_colors,
-                    outline_thickness_in=outline_thickness_in,
-                )
-            elif c in WHITE_STONES:  # white stone.
-                draw_stone(
-                    board,
-                    x,
-                    y,
-                    stone_size_px,
-                    is_black=invert_colors,
-                    outline_thickness_in=outline_thickness_in,
-                )
-            elif create_key and c == "X":  # solution.
-                marks.append((x, y))
-
-            if create_key:
-                if c not in "!@+" and c in NUM_CHARS:
-                    solution_nums.append(((x, y), c))
+    board_width = problem_dict["board-width"]
+    board_height = problem_dict["board-height"]
 
     if max_x == 0:
-        max_x = 18
+        max_x = board_width - 1
     if max_y == 0:
-        max_y = 18
+        max_y = board_height - 1
 
     """
-    Step 4) Adjusts the bounding box to crop out the puzzle while also
-            leaning more toward keeping diagrams ideal for horizontal display.
+    Step 3) Flips the puzzle randomly by transforming the coordinates
+            of its stones and marks, so the board can be drawn
+            already in its flipped orientation.
     """
-
-    # flips the puzzle randomly.
-    if flip_xy:
-        board = board.transpose(Image.TRANSPOSE)
-    if flip_x:
-        board = board.transpose(Image.FLIP_TOP_BOTTOM)
-    if flip_y:
-        board = board.transpose(Image.FLIP_LEFT_RIGHT)
+    transform, flipped_size = make_point_transform(
+        board_width, board_height, flip_xy, flip_x, flip_y
+    )
 
     # simulates the reflections to determine where to crop the image.
-    # the solution marks are reflected here as well and
-    # then ultimately drawn.
     is_top = True
     is_left = True
     if flip_xy:
-        placeholder = is_top
-        is_top = is_left
-        is_left = placeholder
-
-        placeholder = max_x
-        max_x = max_y
-        max_y = placeholder
-
-        marks = [(y, x) for x, y in marks]
-        solution_nums = [((p[1], p[0]), c) for p, c in solution_nums]
-
+        is_top, is_left = is_left, is_top
+        max_x, max_y = max_y, max_x
     if flip_x:
         is_top = not is_top
-        marks = [(x, 18 - y) for x, y in marks]
-        solution_nums = [((p[0], 18 - p[1]), c) for p, c in solution_nums]
-
     if flip_y:
         is_left = not is_left
-        marks = [(18 - x, y) for x, y in marks]
-        solution_nums = [((18 - p[0], p[1]), c) for p, c in solution_nums]
+
+    """
+    Step 4) Places stones and determines the bounding box of the stones.
+    """
+    invert_colors = color_to_play != "default" and default_to_play != color_to_play
+    NUM_CHARS = "123456789" + BLACK_STONES[1:] + WHITE_STONES[1:]
+
+    stones = []
+    marks = []
+    solution_nums = []
+    for y, line in enumerate(lines):
+        for x, c in enumerate(line):
+            draw_x, draw_y = transform(x, y)
+            if c in BLACK_STONES:  # black stone.
+                stones.append((draw_x, draw_y, not invert_colors))
+            elif c in WHITE_STONES:  # white stone.
+                stones.append((draw_x, draw_y, invert_colors))
+            elif create_key and c == "X":  # solution.
+                marks.append((draw_x, draw_y))
+
+            if create_key:
+                if c not in "!@+" and c in NUM_CHARS:
+                    solution_nums.append((draw_x, draw_y, c))
 
     # counts the number of solutions this problem has.
     num_solutions = 0
@@ -248,38 +240,22 @@ def make_diagram(
         color_to_play == "default" and default_to_play == "black"
     )
     mark_is_black = (is_black and not invert_colors) or (not is_black and invert_colors)
+    placed_marks = []
     for x, y in marks:
         if draw_sole_solving_stone and num_solutions == 1:
-            draw_stone(
-                board,
-                x,
-                y,
-                stone_size_px,
-                is_black=is_black,
-                outline_thickness_in=outline_thickness_in,
-            )
+            stones.append((x, y, is_black))
 
         black_mark = (
             not mark_is_black
             if draw_sole_solving_stone and len(marks) == 1
             else mark_is_black
         )
-
-        draw_mark(board, x, y, stone_size_px, is_black=black_mark)
-
-    for point, char in solution_nums:
-        x, y = point
-        draw_key_number(
-            board,
-            x,
-            y,
-            stone_size_px,
-            char,
-        )
+        placed_marks.append((x, y, black_mark))
 
     # crops the puzzle.
-    w, h = board.size
     OFF = BOARD_PADDING_PX
+    w = stone_size_px * flipped_size[0] + OFF * 2
+    h = stone_size_px * flipped_size[1] + OFF * 2
     left = 0 if is_left else max(0, w - stone_size_px * display_width - OFF)
     right = min(w - 1, left + stone_size_px * display_width + OFF)
     top = 0 if is_top else max(0, h - stone_size_px * (max_y + 2) - OFF)
@@ -291,12 +267,18 @@ def make_diagram(
         top = 0
         bottom = h - 1
 
-    if not (left <= 0 and top <= 0 and bottom >= h - 1 and right >= w - 1):
-        board = board.crop((left, top, right, bottom))
+    if left <= 0 and top <= 0 and bottom >= h - 1 and right >= w - 1:
+        crop_box = (0, 0, w, h)
+    else:
+        crop_box = (left, top, right, bottom)
+
+    w, h = crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]
 
     """
-    Step 5) Creates the image text for below the diagram.
+    Step 5) Places the text for below the diagram.
     """
+    labels = []
+    additional_height = 0
     if include_text:
         # determines if the color to play should be displayed.
         MULTICOLOR_COLLECTIONS = ["gokyo-shumyo", "xuanxuan-qijing", "igo-hatsuyoron"]
@@ -349,40 +331,400 @@ def make_diagram(
         TEXT_PADDING_BOTTOM = TEXT_PADDING_BOTTOM_IN * DPI
 
         if label_str is None:
-            label_image = None
-            text_image = create_text_image(text_str, text_rgb, text_height_in)
-            additional_height = int(
-                text_image.size[1] + TEXT_PADDING_TOP + TEXT_PADDING_BOTTOM
-            )
+            text_w, text_h = measure_text(text_str, text_height_in)[:2]
+            additional_height = int(text_h + TEXT_PADDING_TOP + TEXT_PADDING_BOTTOM)
+
+            text_x = int(w / 2 - text_w / 2)
+            labels.append((text_str, text_x, int(h + TEXT_PADDING_TOP), text_height_in))
         else:
-            label_image = create_text_image(label_str, text_rgb, text_height_in / 2)
-            text_image = create_text_image(text_str, text_rgb, text_height_in / 2)
+            label_w, label_h = measure_text(label_str, text_height_in / 2)[:2]
+            text_w, text_h = measure_text(text_str, text_height_in / 2)[:2]
             additional_height = int(
-                label_image.size[1]
-                + text_image.size[1]
-                + TEXT_PADDING_TOP
-                + TEXT_PADDING_BOTTOM
+                label_h + text_h + TEXT_PADDING_TOP + TEXT_PADDING_BOTTOM
             )
 
-        """
-        Step 6) Combines the diagram and label as one image.
-        """
-        w, h = board.size
-        new_image = Image.new("RGB", (w, h + additional_height), (255, 255, 255))
-        new_image.paste(board, (0, 0))
-
-        if label_str is None:
-            text_x = int(w / 2 - text_image.size[0] / 2)
-            new_image.paste(text_image, (text_x, int(h + TEXT_PADDING_TOP)))
-        else:
-            label_x = int(w / 2 - label_image.size[0] / 2)
-            new_image.paste(label_image, (label_x, int(h + TEXT_PADDING_TOP)))
+            label_x = int(w / 2 - label_w / 2)
+            labels.append(
+                (label_str, label_x, int(h + TEXT_PADDING_TOP), text_height_in / 2)
+            )
 
-            text_x = int(w / 2 - text_image.size[0] / 2)
-            new_image.paste(
-                text_image, (text_x, int(h + TEXT_PADDING_TOP + label_image.size[1]))
+            text_x = int(w / 2 - text_w / 2)
+            labels.append(
+                (
+                    text_str,
+                    text_x,
+                    int(h + TEXT_PADDING_TOP + label_h),
+                    text_height_in / 2,
+                )
             )
 
+    layout = DiagramLayout(
+        stone_size_px=stone_size_px,
+        board_size=flipped_size,
+        crop_box=crop_box,
+        size=(w, h + additional_height),
+        line_width_in=line_width_in,
+        star_point_radius_in=star_point_radius(stone_size_px, star_point_radius_in),
+        outline_thickness_in=outline_thickness_in,
+        solution_mark=solution_mark,
+        text_rgb=text_rgb,
+        color_mode=color_mode,
+    )
+    layout.stones = stones
+    layout.marks = placed_marks
+    layout.numbers = solution_nums
+    layout.labels = labels
+
+    # the key covers the problem's content and every parameter
+    # which changes the look of the diagram.
+    layout.cache_params = dict(
+        renderer_version=RENDERER_VERSION,
+        dpi=DPI,
+        lines=lines,
+        default_to_play=default_to_play,
+        problem_num=problem_num,
+        collection_name=collection_name,
+        section_name=section_name,
+        color_to_play=color_to_play,
+        is_random_color=is_random_color,
+        flip_xy=flip_xy,
+        flip_x=flip_x,
+        flip_y=flip_y,
+        stone_size_px=stone_size_px,
+        include_text=include_text,
+        show_problem_num=show_problem_num,
+        force_color_to_play=force_color_to_play,
+        create_key=create_key,
+        draw_sole_solving_stone=draw_sole_solving_stone,
+        solution_mark=solution_mark,
+        text_rgb=text_rgb,
+        text_height_in=text_height_in,
+        display_width=display_width,
+        write_collection_label=write_collection_label,
+        outline_thickness_in=outline_thickness_in,
+        line_width_in=line_width_in,
+        star_point_radius_in=star_point_radius_in,
+        ratio_to_flip_xy=ratio_to_flip_xy,
+        color_mode=color_mode,
+    )
+
+    return layout
+
+
+def split_key_layout(problem_layout, key_layout):
+    """
+    Returns the DiagramLayouts (common, problem_only, key_only)
+    which the problem's diagram and its key's diagram are made of
+    when the key is drawn over the problem:
+    - common: the board and the stones and labels they both have.
+    - problem_only: what's hidden when the key is shown,
+                    such as stones captured while playing out the solution.
+    - key_only: the played-out stones, marks, numbers and labels of the key.
+
+    The problem-only and key-only layouts are meant to be drawn
+    without their board on top of the common layout.
+    """
+    problem_stones = set(problem_layout.stones)
+    key_stones = set(key_layout.stones)
+    same_labels = (
+        problem_layout.labels == key_layout.labels
+        and problem_layout.text_rgb == key_layout.text_rgb
+    )
+
+    common = copy.copy(problem_layout)
+    common.stones = [s for s in problem_layout.stones if s in key_stones]
+    common.marks = []
+    common.numbers = []
+    common.labels = problem_layout.labels if same_labels else []
+    common.cache_params = dict(problem_layout.cache_params, key_layer="common")
+
+    problem_only = copy.copy(common)
+    problem_only.stones = [s for s in problem_layout.stones if s not in key_stones]
+    problem_only.labels = [] if same_labels else problem_layout.labels
+    problem_only.cache_params = None
+
+    key_only = copy.copy(key_layout)
+    key_only.stones = [s for s in key_layout.stones if s not in problem_stones]
+    key_only.labels = [] if same_labels else key_layout.labels
+    key_only.cache_params = None
+
+    return common, problem_only, key_only
+
+
+def rasterize_diagram(layout, include_labels: bool = True, cache=None):
+    """
+    Returns a PIL Image of the DiagramLayout in the layout's color mode.
+
+    Parameters:
+        layout (DiagramLayout): the diagram to draw.
+        include_labels (bool): if False, only the board is drawn, without
+                               the labels or the space below it for them,
+                               so the labels can be written as real text.
+        cache (DiagramCache): if given, the diagram is looked up in this
+                              on-disk cache before being drawn and
+                              is saved to it afterward.
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(include_labels=include_labels, **layout.cache_params)
+        cached_diagram = cache.get(cache_key)
+        if cached_diagram is not None:
+            return cached_diagram
+
+    draw_mode = drawing_mode(layout.color_mode)
+    stone_size_px = layout.stone_size_px
+
+    refresh_stone_graphics(
+        stone_size_px, layout.solution_mark, layout.outline_thickness_in, mode=draw_mode
+    )
+
+    # draws a full board.
+    board, board_draw = draw_board(
+        stone_size_px=stone_size_px,
+        line_width_in=layout.line_width_in,
+        star_point_radius_in=layout.star_point_radius_in,
+        board_size=layout.board_size,
+        mode=draw_mode,
+    )
+
+    # draws stones.
+    for x, y, is_black in layout.stones:
+        draw_stone(
+            board,
+            x,
+            y,
+            stone_size_px,
+            is_black=is_black,
+            outline_thickness_in=layout.outline_thickness_in,
+        )
+
+    for x, y, is_black in layout.marks:
+        draw_mark(board, x, y, stone_size_px, is_black=is_black)
+
+    for x, y, char in layout.numbers:
+        draw_key_number(board, x, y, stone_size_px, char)
+
+    # crops the puzzle.
+    if layout.crop_box != (0, 0, *board.size):
+        board = board.crop(layout.crop_box)
+
+    if include_labels and layout.labels:
+        # combines the diagram and label as one image.
+        new_image = Image.new(draw_mode, layout.size, "white")
+        new_image.paste(board, (0, 0))
+
+        for text, x, y, text_height_in in layout.labels:
+            text_image = create_text_image(text, layout.text_rgb, text_height_in)
+            new_image.paste(text_image, (x, y))
+
         board = new_image
 
+    board = convert_to_color_mode(board, layout.color_mode)
+
+    if cache is not None:
+        cache.put(cache_key, board)
+
     return board
+
+
+def make_diagram(
+    diagram_width_in,
+    problem_num: int = None,
+    collection_name: str = None,
+    section_name: str = None,
+    latex_str: str = None,
+    color_to_play: str = "default",
+    is_random_color: bool = False,
+    flip_xy: bool = True,
+    flip_x: bool = True,
+    flip_y: bool = True,
+    include_text: bool = True,
+    show_problem_num: bool = True,
+    force_color_to_play: bool = False,
+    create_key: bool = True,
+    play_out_solution: bool = False,
+    draw_sole_solving_stone: bool = False,
+    solution_mark: str = "x",
+    text_rgb: tuple = (127, 127, 127),
+    text_height_in=0.2,
+    display_width: int = 12,
+    write_collection_label: bool = False,
+    outline_thickness_in=1 / 128,
+    line_width_in=1 / 96,
+    star_point_radius_in=None,
+    ratio_to_flip_xy=5 / 6,
+    cache=None,
+    color_mode: str = "RGB",
+):
+    """
+    Returns a PIL Image of a Life and Death diagram for the desired problem.
+
+    Parameters:
+        diagram_width_in (num): the output diagram width in inches.
+        problem_num (int): the problem number.
+        collection_name (str): the name of the collection to use.
+            - "cho-elementary"
+            - "cho-intermediate"
+            - "cho-advanced"
+            - "gokyo-shumyo"
+            - "xuanxuan-qijing"
+            - "igo-hatsuyoron"
+        section_name (str): the name of the section to use.
+                            for any collection other than the Gokyo Shumyo
+                            this will be None.
+        latex_str (str): overrides the problem selection process and just
+                         makes a diagram of the LaTeX given directly.
+                         None by default.
+        color_to_play (str):
+            - "default": keeps stone colors as they are in the original data.
+            - "black": forces the player to move to be black.
+            - "white": forces the player to move to be white.
+            - "random": forces the player to move to be random.
+        is_random_color (bool): True if the color was gotten through randomization.
+                                Don't worry about this if color_to_play is "random".
+        flip_xy (bool): if True, problem has its X/Y axes flipped.
+        flip_x (bool): if True, problem is flipped across X-axis.
+        flip_y (bool): if True, problem is flipped across Y-axis.
+        include_text (bool): if True, a problem label
+                             will be added to the diagram.
+        show_problem_num (bool): if True, the problem number will be shown on the worksheet.
+                                 the number is always shown on the key no matter what.
+        force_color_to_play (bool): if True, the label "black/white to play"
+                                    is shown no matter what.
+        create_key (bool): if True, the problem solution(s) is/are marked.
+        draw_sole_solving_stone (bool): if True, a stone will be drawn
+                                        before the solution marker is drawn
+                                        on top of the image, but only if the
+                                        puzzle has one single solution alone.
+        solution_mark (str): the name of the image marker to use:
+                             - "x"
+                             - "star"
+        text_rgb (tuple): the RGB for the label below the diagram.
+        text_height_in (num): the height of the label text.
+        display_width (int): the maximum width of the board displayed.
+                             12 is a good value for Cho's problems.
+        write_collection_label (bool): if True, the collection name is shown.
+        line_width_in (num): the width in inches of the board lines.
+        star_point_radius_in (num): the radius of the star points in inches.
+        ratio_to_flip_xy (num): the ratio a puzzle must fall within
+                                to have its X/Y axes considered possibly randomly flipped.
+                                5/6 assumes the bbox of the puzzle's side lengths have a ratio
+                                that falls between 5/6 and 6/5.
+        cache (DiagramCache): if given, the diagram is looked up in this
+                              on-disk cache before being drawn and
+                              is saved to it afterward.
+        color_mode (str): the mode of the returned image:
+                          - "RGB": full color.
+                          - "L": 8-bit grayscale.
+                          - "1": 1-bit black and white,
+                                 where the gray lines and labels become black.
+    """
+    layout = layout_diagram(
+        diagram_width_in,
+        problem_num=problem_num,
+        collection_name=collection_name,
+        section_name=section_name,
+        latex_str=latex_str,
+        color_to_play=color_to_play,
+        is_random_color=is_random_color,
+        flip_xy=flip_xy,
+        flip_x=flip_x,
+        flip_y=flip_y,
+        include_text=include_text,
+        show_problem_num=show_problem_num,
+        force_color_to_play=force_color_to_play,
+        create_key=create_key,
+        play_out_solution=play_out_solution,
+        draw_sole_solving_stone=draw_sole_solving_stone,
+        solution_mark=solution_mark,
+        text_rgb=text_rgb,
+        text_height_in=text_height_in,
+        display_width=display_width,
+        write_collection_label=write_collection_label,
+        outline_thickness_in=outline_thickness_in,
+        line_width_in=line_width_in,
+        star_point_radius_in=star_point_radius_in,
+        ratio_to_flip_xy=ratio_to_flip_xy,
+        color_mode=color_mode,
+    )
+
+    return rasterize_diagram(layout, cache=cache)
+
+
+def preload_resources(
+    color_mode: str = "RGB",
+    stone_size_px: int = None,
+    solution_mark: str = "x",
+    outline_thickness_in=1 / 96,
+):
+    """
+    Loads the problems and fonts, as well as the stone graphics
+    of the given style if a stone size is given,
+    so the first diagram isn't held up by loading them.
+    """
+    get_problems()
+    load_fonts()
+    if stone_size_px is not None:
+        refresh_stone_graphics(
+            stone_size_px,
+            solution_mark,
+            outline_thickness_in,
+            mode=drawing_mode(color_mode),
+        )
+
+
+def _init_diagram_worker():
+    # loads the problems and fonts before any diagrams are requested.
+    preload_resources()
+
+
+def _make_diagram_from_spec(spec: dict, image_format: str):
+    """Returns the diagram for one spec, encoded if an image format is given."""
+    diagram = make_diagram(**spec)
+    if image_format is None:
+        return diagram
+
+    buffer = io.BytesIO()
+    diagram.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def make_diagrams(
+    specs,
+    workers: int = None,
+    chunksize: int = 4,
+    image_format: str = None,
+):
+    """
+    Yields the diagrams for many problems, which are rendered in parallel.
+    The results come out in the same order as the given specs,
+    each one as soon as it and all the ones before it are finished.
+
+    Parameters:
+        specs (iterable): dicts of keyword arguments for make_diagram.
+                          each must contain "diagram_width_in".
+        workers (int): the number of processes used to render.
+                       if None, one is used for every CPU
+                       this process is allowed to use.
+                       if 1, the diagrams are rendered in this process.
+        chunksize (int): the number of specs handed to a worker at once.
+                         consecutive specs sharing a style should be kept
+                         together so each worker reuses its stone graphics.
+        image_format (str): if given (e.g. "PNG"), the diagrams are yielded
+                            as bytes encoded by the workers in this format
+                            instead of as PIL Images.
+    """
+    if workers is None:
+        workers = available_cpus()
+
+    if workers <= 1:
+        for spec in specs:
+            yield _make_diagram_from_spec(spec, image_format)
+        return
+
+    render = partial(_make_diagram_from_spec, image_format=image_format)
+    with multiprocessing.Pool(
+        processes=workers, initializer=_init_diagram_worker
+    ) as pool:
+        for result in pool.imap(render, specs, chunksize=chunksize):
+            yield result
@@ -0,0 +1,159 @@
+"""
+tsumego_pdf.draw_game.diagram_cache.py
+---
+This file contains an opt-in on-disk cache of rendered diagrams,
+so jobs which keep selecting the same problems with the same style
+don't have to rasterize every diagram from scratch each time.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from PIL import Image
+
+_FILE_EXT = ".png"
+_EVICT_TO_RATIO = 0.9  # eviction stops once the cache is under 90% of its limit.
+
+
+class DiagramCache:
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Parameters:
+            cache_dir (str): the directory the rendered diagrams are saved in.
+                             it's created if it doesn't exist yet and
+                             can be shared between several processes.
+            max_bytes (int): the total size the cached files may take up.
+                             the least recently used diagrams are removed
+                             once this is exceeded.
+        """
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._approx_bytes = None  # counted on the first write.
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(**params):
+        """
+        Returns a hex digest identifying a diagram
+        from everything that affects how it's drawn.
+        """
+        encoded = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _path_of(self, key: str):
+        # entries are spread across subdirectories to keep listings short.
+        return os.path.join(self.cache_dir, key[:2], key + _FILE_EXT)
+
+    def get(self, key: str):
+        """Returns the cached PIL Image for the key, or None if it isn't cached."""
+        path = self._path_of(key)
+        try:
+            with Image.open(path) as image:
+                image.load()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except OSError:
+            # the file is unreadable, so it's thrown out.
+            self.misses += 1
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)  # marks the entry as recently used.
+        except OSError:
+            # the image was still loaded, such as if another process
+            # evicted it just now, so it's counted as a hit regardless.
+            pass
+
+        self.hits += 1
+        return image
+
+    def put(self, key: str, image):
+        """Saves the PIL Image to the cache under the given key."""
+        path = self._path_of(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # the image is written to a temp file in the same directory and
+        # then renamed, so other processes never see a partially written file.
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                image.save(temp_file, format="PNG")
+            os.replace(temp_path, path)
+        except BaseException:
+            self._remove(temp_path)
+            raise
+
+        if self._approx_bytes is None:
+            self._approx_bytes = self._total_bytes()
+        else:
+            self._approx_bytes += os.path.getsize(path)
+
+        if self._approx_bytes > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        """Returns a list of (last used time, size, path) for every cached file."""
+        entries = []
+        for root, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if not file_name.endswith(_FILE_EXT):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # removed by another process.
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        return entries
+
+    def _total_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Removes the least recently used diagrams until the cache fits its limit."""
+        entries = self._entries()
+        total_bytes = sum(size for _, size, _ in entries)
+
+        if total_bytes > self.max_bytes:
+            target_bytes = self.max_bytes * _EVICT_TO_RATIO
+            entries.sort()
+            for _, size, path in entries:
+                if total_bytes <= target_bytes:
+                    break
+                self._remove(path)
+                total_bytes -= size
+
+        self._approx_bytes = total_bytes
+
+    def clear(self):
+        """Removes every diagram from the cache."""
+        for _, _, path in self._entries():
+            self._remove(path)
+        self._approx_bytes = 0
+
+    def stats(self):
+        """Returns a dict with the hit-rate statistics of this cache."""
+        lookups = self.hits + self.misses
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "num_entries": len(entries),
+            "total_bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
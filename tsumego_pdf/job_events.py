@@ -0,0 +1,264 @@
+"""
+tsumego_pdf.job_events.py
+---
+This file contains functionality to report what create_pdf(...) is doing
+as events, which are all handled by the calling process, so the workers
+never wait on each other to count their progress or print it.
+"""
+
+import os
+import threading
+import time
+from tsumego_pdf.write_pdf import progress_bar
+
+# the stages of a job, in the order they begin:
+# - "load": loading the problems.
+# - "start": starting the workers and loading what they draw with.
+# - "layout": laying out the pages.
+# - "render": drawing the diagrams (summed across the workers).
+# - "encode": compressing the rasterized diagrams (summed across the workers).
+# - "write": writing the pages to a PDF (or SVG files).
+# - "impose": arranging the pages on the papers of a booklet and writing them.
+STAGES = ("load", "start", "layout", "render", "encode", "write", "impose")
+
+
+class JobResult:
+    def __init__(self):
+        """
+        What create_pdf(...) made and how long each stage of it took.
+
+        Attributes:
+            problems_out_path (str): the path of the problems.
+            solutions_out_path (str): the path of the key, if it was separate.
+            num_pages (int): the number of pages of the problems.
+            num_diagrams (int): the number of diagrams rendered,
+                                including those of the key.
+            stage_seconds (dict): the seconds each stage took by its name.
+                                  the stages done by the workers are summed
+                                  across them, and the stages done at the
+                                  same time overlap, so these don't add up
+                                  to the seconds of the whole job.
+            bytes_written (dict): the size of each file written by its path.
+            cache_hits (int): the diagrams found in the diagram cache.
+            cache_misses (int): the diagrams not found in the diagram cache.
+            seconds (num): how long the whole job took.
+            memory (MemoryReport): how much memory the job used,
+                                   if it was measured (otherwise None).
+        """
+        self.problems_out_path = None
+        self.solutions_out_path = None
+        self.num_pages = 0
+        self.num_diagrams = 0
+        self.stage_seconds = {}
+        self.bytes_written = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.seconds = 0
+        self.memory = None
+
+    def __repr__(self):
+        return (
+            f"JobResult(num_pages={self.num_pages}, "
+            f"num_diagrams={self.num_diagrams}, seconds={self.seconds:.2f})"
+        )
+
+
+class JobMonitor:
+    def __init__(
+        self, on_event=None, verbose: bool = False, trace=None, memory=None
+    ):
+        """
+        Collects the events of a job into its JobResult
+        and hands each one to on_event as it happens.
+        It can be told of events by any thread of the calling process,
+        but on_event is only ever called by one of them at a time.
+
+        Every event is a dict with a "type":
+        - "stage": a stage ended. it has the "stage", its "seconds"
+                   and whatever else is known about it, such as
+                   "num_pages", "num_diagrams", "cache_hits"
+                   and "cache_misses". if memory is being measured,
+                   it also has the "memory" of this process
+                   when the stage ended (see MemoryReport).
+        - "output": a writer saved its files. it has the "stage"
+                    ("write" or "impose"), the "paths" of the files,
+                    the "num_pages" written to them, their total "bytes"
+                    and the "seconds" the writer took.
+        - "progress": a diagram was rendered. it has the "stage",
+                      the number of diagrams "done" out of the "total",
+                      the "fraction" done, and the "eta_seconds" left
+                      (estimated from how large the diagrams left are).
+                      the total, fraction and ETA are None if the number
+                      of diagrams isn't known yet.
+
+        Parameters:
+            on_event (function): called with each event.
+            verbose (bool): if True, the render progress bar is printed.
+            trace (Trace): if given, a span is added to it for the time
+                           each thread spends on a stage, along with
+                           the spans of the workers' diagrams.
+            memory (MemoryReport): if given, the memory of this process
+                                   is measured as each stage ends,
+                                   along with that of the workers.
+        """
+        self.on_event = on_event
+        self.verbose = verbose
+        self.trace = trace
+        self.memory = memory
+        if memory is not None:
+            memory.start()
+        self.result = JobResult()
+        self._start_time = time.time()
+        self._render_start_time = None
+        self._lock = threading.RLock()  # on_event can tell it of more events.
+
+        self._total_diagrams = None
+        self._total_cost = None
+        self._cost_done = 0
+
+    def _emit(self, event: dict):
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def _add_span(self, stage: str, seconds, **args):
+        # the stage's time was just spent by the calling thread.
+        # it's named apart from the spans within it which have the same name,
+        # such as a diagram's "layout", so trace viewers don't merge them.
+        if self.trace is not None and seconds > 0:
+            end = time.perf_counter()
+            self.trace.add(f"stage:{stage}", "stage", end - seconds, end, **args)
+
+    def add_seconds(self, stage: str, seconds):
+        """Adds to the time spent in the stage without ending it."""
+        self._add_span(stage, seconds)
+        with self._lock:
+            stage_seconds = self.result.stage_seconds
+            stage_seconds[stage] = stage_seconds.get(stage, 0) + seconds
+
+    def end_stage(self, stage: str, seconds=0, **info):
+        """
+        Ends the stage after the given seconds more were spent on it.
+        Each stage is only ended once.
+        """
+        self._add_span(stage, seconds)
+        with self._lock:
+            stage_seconds = self.result.stage_seconds
+            stage_seconds[stage] = stage_seconds.get(stage, 0) + seconds
+            if self.memory is not None:
+                if stage not in self.memory.stages:
+                    self.memory.sample_stage(stage)
+                info["memory"] = self.memory.stages[stage]
+            self._emit(
+                dict(type="stage", stage=stage, seconds=stage_seconds[stage], **info)
+            )
+
+    def timed(self, stage: str, func, *args, **info):
+        """Returns func(*args) and ends the stage with how long it took."""
+        start = time.time()
+        value = func(*args)
+        self.end_stage(stage, time.time() - start, **info)
+        return value
+
+    def start_render(self, total_diagrams: int = None, total_cost=None):
+        """
+        Starts counting the rendered diagrams, of which there are
+        total_diagrams whose costs add up to total_cost if they're known.
+        """
+        self._render_start_time = time.time()
+        self._total_diagrams = total_diagrams
+        self._total_cost = total_cost
+
+    def diagram_done(
+        self, cost, stats: tuple, spans: list = None, worker_memory: tuple = None
+    ):
+        """
+        Counts a diagram rendered by a worker.
+
+        Parameters:
+            cost (num): about how long the diagram took
+                        compared to the others.
+            stats (tuple): (render_seconds, encode_seconds,
+                            cache_hits, cache_misses) from the worker.
+            spans (list): the trace events of the worker's spans, if any.
+            worker_memory (tuple): (pid, peak_rss) of the worker, if its
+                                   memory was measured.
+        """
+        render_seconds, encode_seconds, cache_hits, cache_misses = stats
+        if spans and self.trace is not None:
+            self.trace.extend(spans)
+        with self._lock:
+            if worker_memory is not None and self.memory is not None:
+                self.memory.add_worker_peak(*worker_memory)
+            result = self.result
+            result.num_diagrams += 1
+            result.cache_hits += cache_hits
+            result.cache_misses += cache_misses
+            stage_seconds = result.stage_seconds
+            stage_seconds["render"] = stage_seconds.get("render", 0) + render_seconds
+            if encode_seconds:
+                stage_seconds["encode"] = (
+                    stage_seconds.get("encode", 0) + encode_seconds
+                )
+            self._cost_done += cost
+
+            fraction = eta = None
+            if self._total_diagrams is not None and self._total_cost:
+                fraction = min(1, self._cost_done / self._total_cost)
+                elapsed = time.time() - self._render_start_time
+                eta = elapsed * (1 - fraction) / fraction
+            self._emit(
+                dict(
+                    type="progress",
+                    stage="render",
+                    done=result.num_diagrams,
+                    total=self._total_diagrams,
+                    fraction=fraction,
+                    eta_seconds=eta,
+                )
+            )
+
+            if self.verbose:
+                if fraction is None:
+                    # while streaming, only the number of diagrams is known.
+                    print(
+                        f"\r{'1) Render':<10} {result.num_diagrams} diagrams",
+                        end="",
+                        flush=True,
+                    )
+                else:
+                    progress_bar(fraction, eta, prefix="1) Render")
+
+    def add_output(self, stage: str, paths: list, num_pages: int, seconds):
+        """Counts the files a writer saved to paths in the given seconds."""
+        sizes = {path: os.path.getsize(path) for path in paths}
+        self._add_span(stage, seconds, paths=list(paths))
+        with self._lock:
+            if self.memory is not None:
+                # measured as each writer finishes rather than once they all have.
+                self.memory.sample_stage(stage)
+            self.result.bytes_written.update(sizes)
+            stage_seconds = self.result.stage_seconds
+            stage_seconds[stage] = stage_seconds.get(stage, 0) + seconds
+            self._emit(
+                dict(
+                    type="output",
+                    stage=stage,
+                    paths=list(paths),
+                    num_pages=num_pages,
+                    bytes=sum(sizes.values()),
+                    seconds=seconds,
+                )
+            )
+
+    def finish(self):
+        """Returns the JobResult once the job is done."""
+        self.result.seconds = time.time() - self._start_time
+        if self.memory is not None:
+            self.memory.finish()
+            self.result.memory = self.memory
+        return self.result
+
+    def close(self):
+        """Stops measuring memory, even if the job failed before finishing."""
+        if self.memory is not None:
+            self.memory.stop()
@@ -0,0 +1,135 @@
+"""
+tsumego_pdf.memory.py
+---
+This file contains functionality to measure how much memory
+the processes making a PDF use, so it can be told which stage
+of a job needs the most of it.
+"""
+
+import os
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # the resource module is only available on Unix.
+    resource = None
+
+_PROC_STATM = "/proc/self/statm"
+_NUM_TOP_ALLOCATIONS = 10
+
+
+def peak_rss():
+    """
+    Returns the most memory this process has had resident so far in bytes,
+    or None if that can't be told on this system.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux gives KiB.
+
+
+def current_rss():
+    """
+    Returns the memory this process has resident right now in bytes,
+    or None if that can't be told on this system.
+    """
+    try:
+        with open(_PROC_STATM, "r") as in_file:
+            resident_pages = int(in_file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class MemoryReport:
+    def __init__(self):
+        """
+        How much memory a job used, which is measured at the end of each
+        stage in this process and with every diagram in the workers.
+
+        Attributes:
+            stages (dict): {"rss", "peak_rss_so_far", "python_peak"}
+                           of this process by the name of each stage,
+                           measured when it ended (or when the last of
+                           its writers finished). rss is the memory resident
+                           right then, and peak_rss_so_far is the most
+                           that's been resident since the process started,
+                           so it's the same for every stage after the one
+                           which needed the most. python_peak is the most
+                           memory allocated by Python since the measurement
+                           before it, so it's the only one of the stage alone.
+            worker_peak_rss (dict): the most memory each worker process
+                                    has had resident since it started
+                                    (which may be before this job, if its
+                                    Renderer was kept open), by its process ID.
+                                    workers which are threads are counted
+                                    as this process.
+            peak_rss (int): the most memory this process has had resident
+                            since it started.
+            top_allocations (list): {"location", "bytes", "count"}
+                                    of the lines of code of this process
+                                    holding the most memory at the end
+                                    of the job, largest first.
+            All sizes are in bytes, and are None if they can't be told
+            on this system.
+        """
+        self.stages = {}
+        self.worker_peak_rss = {}
+        self.peak_rss = None
+        self.top_allocations = []
+        self._started_tracemalloc = False
+
+    def start(self):
+        """Starts tracing Python's allocations if they aren't already."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def sample_stage(self, stage: str):
+        """Measures this process at the end of the stage."""
+        python_peak = None
+        if tracemalloc.is_tracing():
+            python_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+        self.stages[stage] = {
+            "rss": current_rss(),
+            "peak_rss_so_far": peak_rss(),
+            "python_peak": python_peak,
+        }
+
+    def add_worker_peak(self, pid: int, peak: int):
+        """Counts the peak RSS of a worker process."""
+        if pid == os.getpid():
+            return  # the worker is a thread of this process.
+        if peak is not None and peak > self.worker_peak_rss.get(pid, 0):
+            self.worker_peak_rss[pid] = peak
+
+    def stop(self):
+        """Stops tracing Python's allocations if start() began tracing them."""
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def finish(self):
+        """Takes the largest allocations and stops tracing if it started."""
+        self.peak_rss = peak_rss()
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            self.top_allocations = [
+                {
+                    "location": f"{stat.traceback[0].filename}:"
+                    f"{stat.traceback[0].lineno}",
+                    "bytes": stat.size,
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[:_NUM_TOP_ALLOCATIONS]
+            ]
+        self.stop()
+
+    def __repr__(self):
+        return (
+            f"MemoryReport(peak_rss={self.peak_rss}, "
+            f"worker_peak_rss={self.worker_peak_rss})"
+        )
@@ -0,0 +1,239 @@
+"""
+tsumego_pdf.page_stream.py
+---
+This file contains functionality to write the pages of PDFs
+while the rest of their pages are still being rendered,
+so the writers don't wait for the workers and the workers don't wait
+for the writers.
+"""
+
+import threading
+import time
+from tsumego_pdf.trace import add_async_span
+
+
+class PageStream:
+    def __init__(self, num_pages: int, on_take=None):
+        """
+        The pages of one PDF, which come back from the workers in any order.
+        Getting a page waits until it has been rendered, and the stream
+        lets go of it once it's been taken, so each page is taken only once.
+
+        Parameters:
+            num_pages (int): the number of pages the PDF has.
+                             if None, it isn't known until end(...) is called,
+                             so the pages can only be taken in order.
+            on_take (function): called whenever a page has been taken.
+        """
+        self._num_pages = num_pages
+        self._on_take = on_take
+        self._pages = {}  # the rendered pages waiting to be taken by index.
+        self._condition = threading.Condition()
+        self._is_cancelled = False
+
+    def __len__(self):
+        if self._num_pages is None:
+            raise TypeError("the number of pages isn't known yet.")
+        return self._num_pages
+
+    def _is_past_end(self, i: int):
+        return self._num_pages is not None and i >= self._num_pages
+
+    def __getitem__(self, i: int):
+        if i < 0 or self._is_past_end(i):
+            raise IndexError("page index out of range.")
+
+        with self._condition:
+            while i not in self._pages:
+                if self._is_cancelled:
+                    raise RuntimeError("the pages stopped being rendered.")
+                if self._is_past_end(i):
+                    raise IndexError("page index out of range.")
+                self._condition.wait()
+            page = self._pages.pop(i)
+
+        if self._on_take is not None:
+            self._on_take()
+        return page
+
+    def __iter__(self):
+        i = 0
+        while True:
+            try:
+                page = self[i]
+            except IndexError:
+                return
+            yield page
+            i += 1
+
+    def put(self, i: int, page):
+        """Hands over the rendered page to whoever is waiting for it."""
+        with self._condition:
+            self._pages[i] = page
+            self._condition.notify_all()
+
+    def end(self, num_pages: int):
+        """Sets the number of pages once they've all been laid out."""
+        with self._condition:
+            self._num_pages = num_pages
+            self._condition.notify_all()
+
+    def cancel(self):
+        """Makes anyone waiting for a page stop waiting."""
+        with self._condition:
+            self._is_cancelled = True
+            self._pages.clear()
+            self._condition.notify_all()
+
+
+def render_and_write(
+    renderer, pages, streams, writers, max_pending: int, on_result=None
+):
+    """
+    Renders pages with the Renderer while each writer writes its PDF
+    in its own thread from the pages that have come back so far.
+
+    Each page is rendered as parts (its diagrams) which the workers
+    take on one at a time, the longest first, so a page with one large
+    diagram and a page with many small ones keep the workers equally busy.
+    A page is put together as soon as its last part comes back.
+
+    The workers take on a new page only once there are fewer than
+    max_pending pages being rendered or waiting to be written,
+    so the pages waiting for the ones before them never pile up.
+
+    Parameters:
+        renderer (Renderer): the workers to render with.
+        pages (iterable): (stream, page_index, parts, assemble) for every page,
+                          where parts is a list of (cost, func, arg)
+                          which each render a part of the page as func(arg),
+                          cost being about how long that takes,
+                          and assemble(results) puts the page at page_index
+                          of the PageStream together from the results
+                          of its parts in the same order.
+                          the pages of each stream must be given
+                          in the same order its writer takes them.
+                          it's only read as there's room for more pages,
+                          so it can lay out the pages as it goes.
+        streams (list): the PageStreams the pages go to.
+        writers (list): (func, args) to write each PDF,
+                        each of which is run as func(*args).
+        max_pending (int): the most pages which can be out at once.
+        on_result (function): if given, called as on_result(cost, result)
+                              with the result of each part as it comes back,
+                              returning what's given to assemble(...) instead.
+    """
+    pending = threading.Semaphore(max_pending)
+    stop = threading.Event()
+    writer_errors = []
+    destinations = {}  # (page_id, part_index) of the tasks by their index.
+    costs = {}  # the costs of the tasks by their index.
+    start_times = {}  # when the pages were handed out by ID.
+    unfinished = {}  # (stream, page_index, assemble, results) of pages by ID.
+    parts_left = {}  # the number of parts of each page yet to come back by ID.
+
+    for stream in streams:
+        stream._on_take = pending.release
+
+    def take_pages():
+        # yields the pages there's room for in batches,
+        # waiting for room only once every batch has been handed out.
+        batch = []
+        for page in pages:
+            if not pending.acquire(blocking=False):
+                if batch:
+                    yield batch
+                    batch = []
+                while not pending.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+            if stop.is_set():
+                return
+            batch.append(page)
+        if batch:
+            yield batch
+
+    def queue_tasks():
+        # this is run by the pool as it hands out tasks,
+        # so it holds off on the next page until there's room for it.
+        task_i = 0
+        page_id = 0
+        for batch in take_pages():
+            parts = []
+            for stream, page_i, page_parts, assemble in batch:
+                if not page_parts:
+                    stream.put(page_i, assemble([]))
+                    continue
+                results = [None] * len(page_parts)
+                unfinished[page_id] = (stream, page_i, assemble, results)
+                parts_left[page_id] = len(page_parts)
+                start_times[page_id] = time.perf_counter()
+                for part_i, (cost, func, arg) in enumerate(page_parts):
+                    parts.append((cost, page_id, part_i, func, arg))
+                page_id += 1
+
+            # the longest parts are handed out first,
+            # so no worker is left with a long one once the others are done.
+            parts.sort(key=lambda part: -part[0])
+            for cost, part_page_id, part_i, func, arg in parts:
+                if stop.is_set():
+                    return
+                destinations[task_i] = (part_page_id, part_i)
+                if on_result is not None:
+                    costs[task_i] = cost
+                task_i += 1
+                yield func, arg
+
+    def run_writer(func, args):
+        try:
+            func(*args)
+        except BaseException as e:
+            writer_errors.append(e)
+            stop.set()
+
+    threads = [
+        threading.Thread(
+            target=run_writer, args=writer, name=f"writer {i + 1}", daemon=True
+        )
+        for i, writer in enumerate(writers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for task_i, result in renderer.imap_unordered_tasks(queue_tasks()):
+            page_id, part_i = destinations.pop(task_i)
+            stream, page_i, assemble, results = unfinished[page_id]
+            if on_result is not None:
+                result = on_result(costs.pop(task_i), result)
+            results[part_i] = result
+            parts_left[page_id] -= 1
+            if parts_left[page_id] == 0:
+                del unfinished[page_id], parts_left[page_id]
+                stream.put(page_i, assemble(results))
+                add_async_span(
+                    "page",
+                    "render",
+                    page_id,
+                    start_times.pop(page_id),
+                    time.perf_counter(),
+                    page=page_i + 1,
+                    stream=streams.index(stream),
+                )
+    except BaseException:
+        stop.set()
+        for stream in streams:
+            stream.cancel()
+        for thread in threads:
+            thread.join()
+        raise
+
+    if stop.is_set():
+        # a writer failed, so the pages after it were never rendered.
+        for stream in streams:
+            stream.cancel()
+    for thread in threads:
+        thread.join()
+
+    if writer_errors:
+        raise writer_errors[0]
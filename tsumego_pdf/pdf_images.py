@@ -0,0 +1,127 @@
+"""
+tsumego_pdf.pdf_images.py
+---
+This file contains functionality to embed images in a PDF
+at their own color depth, so grayscale and black & white pages
+aren't inflated to 24-bit RGB when they're written.
+
+Images can be encoded ahead of time (e.g. by the workers rendering pages),
+in which case the compressed pixels are copied into the PDF as they are.
+"""
+
+import hashlib
+import zlib
+from reportlab.lib.rl_accel import fp_str
+from reportlab.pdfbase import pdfdoc
+
+_COLOR_SPACES = {"RGB": "DeviceRGB", "L": "DeviceGray", "1": "DeviceGray"}
+
+
+class EncodedImage:
+    def __init__(self, width: int, height: int, mode: str, data: bytes, mask=None):
+        """
+        Parameters:
+            width, height (int): the size of the image in pixels.
+            mode (str): the PIL mode of the pixels ("RGB", "L" or "1").
+            data (bytes): the Flate-compressed pixels, row by row.
+            mask (EncodedImage): the opacity of the pixels as an "L" or "1" image.
+                                 None if the image is opaque.
+        """
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.data = data
+        self.mask = mask
+        self._digest = None
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    @property
+    def digest(self):
+        """Returns a hex digest which identifies the image's contents."""
+        if self._digest is None:
+            digest = hashlib.md5(self.data)
+            digest.update(f"{self.mode}{self.size}".encode("utf-8"))
+            if self.mask is not None:
+                digest.update(self.mask.digest.encode("utf-8"))
+            self._digest = digest.hexdigest()
+        return self._digest
+
+
+def encode_image(image, compress_level: int = 6):
+    """
+    Returns an EncodedImage of the given PIL image's pixels.
+    The alpha channel of an RGBA or LA image becomes the EncodedImage's mask.
+    """
+    mask = None
+    if image.mode in ("RGBA", "LA"):
+        mask = encode_image(image.getchannel("A"), compress_level)
+        image = image.convert(image.mode[:-1])
+
+    if image.mode not in _COLOR_SPACES:
+        image = image.convert("RGB")
+
+    # 1-bit images are packed 8 pixels per byte with each row padded to
+    # a whole byte by Pillow, which is the same layout the PDF expects.
+    data = zlib.compress(image.tobytes(), compress_level)
+    return EncodedImage(image.size[0], image.size[1], image.mode, data, mask)
+
+
+def _create_image_xobject(doc, name: str, encoded):
+    """Returns a PDF image XObject which holds the EncodedImage's stream as is."""
+    xobject = pdfdoc.PDFImageXObject(name)
+    xobject.width, xobject.height = encoded.size
+    xobject.colorSpace = _COLOR_SPACES[encoded.mode]
+    xobject.bitsPerComponent = 1 if encoded.mode == "1" else 8
+    xobject.streamContent = encoded.data
+    xobject._filters = ("FlateDecode",)
+    xobject.mask = None
+
+    if encoded.mask is not None:
+        # the mask is embedded as its own grayscale image (a soft mask).
+        # images with the same shape (e.g. stones in different modes) share it.
+        mask_name = encoded.mask.digest + "-mask"
+        reg_name = doc.getXObjectName(mask_name)
+        if doc.idToObject.get(reg_name) is None:
+            mask_xobject = _create_image_xobject(doc, mask_name, encoded.mask)
+            doc.Reference(mask_xobject, reg_name)
+        xobject.smask = pdfdoc.PDFObjectReference(reg_name)
+
+    return xobject
+
+
+def draw_image(out_pdf, image, x, y, width, height):
+    """
+    Draws an image on the ReportLab canvas.
+    RGB, L (8-bit gray) and 1 (1-bit) images are embedded at that depth.
+    Identical images are only embedded once per document.
+
+    Parameters:
+        out_pdf (Canvas): the ReportLab canvas to draw on.
+        image: an EncodedImage or a PIL Image.
+               an EncodedImage is embedded without being decoded.
+        x, y (num): the bottom-left corner to draw at (72 DPI).
+        width, height (num): the size to draw the image at (72 DPI).
+    """
+    if not isinstance(image, EncodedImage):
+        image = encode_image(image)
+
+    name = image.digest
+
+    # the image is only embedded the first time it's drawn.
+    doc = out_pdf._doc
+    reg_name = doc.getXObjectName(name)
+    if doc.idToObject.get(reg_name) is None:
+        xobject = _create_image_xobject(doc, name, image)
+        doc.Reference(xobject, reg_name)
+
+    # the image is placed with a single matrix, since stones and marks
+    # can be placed hundreds of times on a page.
+    out_pdf._currentPageHasImages = 1
+    out_pdf._code.append(
+        f"q {fp_str(width, 0, 0, height, x, y)} cm /{reg_name} Do Q"
+    )
+    if name not in out_pdf._formsinuse:
+        out_pdf._formsinuse.append(name)
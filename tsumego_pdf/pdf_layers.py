@@ -0,0 +1,100 @@
+"""
+tsumego_pdf.pdf_layers.py
+---
+This file contains functionality to put content on a PDF page
+in an optional content group (a layer), which PDF readers
+can show, hide or print on its own.
+
+The answer key is drawn as a layer over its problems,
+so a single PDF can hold both.
+"""
+
+from reportlab.pdfbase import pdfdoc
+
+KEY_LAYER_TITLE = "Answer Key"
+_KEY_PROPERTY = "TsumegoKey"  # shown while the key is shown.
+_PROBLEM_PROPERTY = "TsumegoProblem"  # hidden while the key is shown.
+
+
+def _get_layer_refs(doc):
+    """Returns the layer's property names and their objects in the document."""
+    refs = getattr(doc, "_tsumego_layer_refs", None)
+    if refs is None:
+        key_group = pdfdoc.PDFDictionary(
+            {
+                "Type": pdfdoc.PDFName("OCG"),
+                "Name": pdfdoc.PDFString(KEY_LAYER_TITLE),
+            }
+        )
+        key_ref = doc.Reference(key_group)
+
+        # a membership dictionary which is visible only when the key isn't.
+        problem_membership = pdfdoc.PDFDictionary(
+            {
+                "Type": pdfdoc.PDFName("OCMD"),
+                "OCGs": key_ref,
+                "P": pdfdoc.PDFName("AllOff"),
+            }
+        )
+        refs = {
+            _KEY_PROPERTY: key_ref,
+            _PROBLEM_PROPERTY: doc.Reference(problem_membership),
+        }
+        doc._tsumego_layer_refs = refs
+
+    return refs
+
+
+def begin_layer(out_pdf, is_key: bool):
+    """
+    Begins content on the current page which is shown with the key (is_key)
+    or which is hidden while the key is shown (not is_key).
+    Every call must be followed by end_layer(...).
+    """
+    _get_layer_refs(out_pdf._doc)
+    name = _KEY_PROPERTY if is_key else _PROBLEM_PROPERTY
+    out_pdf._code.append(f"/OC /{name} BDC")
+
+
+def end_layer(out_pdf):
+    """Ends the content begun by begin_layer(...)."""
+    out_pdf._code.append("EMC")
+
+
+def finish_layers(out_pdf, key_visible: bool = False):
+    """
+    Declares the key's layer in the document, if any content used it.
+    This must be called right before the canvas is saved.
+
+    Parameters:
+        out_pdf (Canvas): the ReportLab canvas to be saved.
+        key_visible (bool): if True, the key is shown when the PDF is opened.
+    """
+    doc = out_pdf._doc
+    refs = getattr(doc, "_tsumego_layer_refs", None)
+    if refs is None:
+        return
+
+    key_ref = refs[_KEY_PROPERTY]
+    catalog = doc.Catalog
+    if "OCProperties" not in catalog.__NoDefault__:
+        catalog.__NoDefault__ = catalog.__NoDefault__ + ["OCProperties"]
+    catalog.OCProperties = pdfdoc.PDFDictionary(
+        {
+            "OCGs": pdfdoc.PDFArray([key_ref]),
+            "D": pdfdoc.PDFDictionary(
+                {
+                    "Order": pdfdoc.PDFArray([key_ref]),
+                    "ON" if key_visible else "OFF": pdfdoc.PDFArray([key_ref]),
+                }
+            ),
+        }
+    )
+
+    # the last page is closed the same way Canvas.save() would,
+    # so the layer's names can be given to every page's resources.
+    if len(out_pdf._code):
+        out_pdf.showPage()
+    for page in doc.Pages.pages:
+        page.check_format(doc)
+        page.Resources.Properties = dict(refs)
@@ -0,0 +1,118 @@
+"""
+tsumego_pdf.pdf_pages.py
+---
+This file contains the PageDrawing, a page which is put together
+on the PDF itself rather than being embedded as a single page image,
+so the page's margins and gutters are never rasterized.
+"""
+
+from tsumego_pdf.pdf_images import draw_image
+from tsumego_pdf.pdf_layers import begin_layer, end_layer
+from tsumego_pdf.pdf_sprites import draw_diagram_instanced
+from tsumego_pdf.pdf_vector import draw_diagram, draw_text, register_fonts
+from tsumego_pdf.trace import span
+
+_DIAGRAM_DRAWERS = {"vector": draw_diagram, "instanced": draw_diagram_instanced}
+
+# rasterized diagrams have their layers drawn with the same graphics.
+_LAYER_DRAWERS = dict(_DIAGRAM_DRAWERS, raster=draw_diagram_instanced)
+
+
+class PageDrawing:
+    def __init__(self, width: int, height: int, mode: str, backend: str = "vector"):
+        """
+        A page which is drawn on the PDF with diagram layouts,
+        rasterized diagrams and text.
+
+        Parameters:
+            width, height (int): the size of the page in pixels (at DPI).
+            mode (str): the color mode the page is drawn in.
+            backend (str): how the diagram layouts are drawn:
+                           - "vector": as paths.
+                           - "instanced": as placements of embedded graphics.
+        """
+        self.width = int(width)
+        self.height = int(height)
+        self.mode = mode
+        self.backend = backend
+        self.images = []  # (x_px, y_px, EncodedImage).
+        self.diagrams = []  # (x_px, y_px, DiagramLayout).
+
+        # drawn without their boards over the diagrams above
+        # in the answer key's layer, or hidden while the key is shown.
+        self.key_layer = []  # (x_px, y_px, DiagramLayout).
+        self.problem_layer = []  # (x_px, y_px, DiagramLayout).
+        self.texts = []  # (text, x_px, y_px, text_height_in, rgb).
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    def add(self, other):
+        """Adds everything drawn on another PageDrawing of the same size."""
+        self.images.extend(other.images)
+        self.diagrams.extend(other.diagrams)
+        self.key_layer.extend(other.key_layer)
+        self.problem_layer.extend(other.problem_layer)
+        self.texts.extend(other.texts)
+
+
+def draw_page_drawing(out_pdf, page, x, y, width, height):
+    """
+    Draws the PageDrawing on the ReportLab canvas
+    in the same place draw_image(...) would put an image of the page.
+
+    Parameters:
+        out_pdf (Canvas): the ReportLab canvas to draw on.
+        page (PageDrawing): the page to draw.
+        x, y (num): the bottom-left corner to draw at (72 DPI).
+        width, height (num): the size to draw the page at (72 DPI).
+    """
+    scale = width / page.width
+    top = y + height
+
+    # identical diagrams are only embedded once by draw_image(...).
+    with span("images", "draw", count=len(page.images)):
+        for image_x, image_y, image in page.images:
+            draw_image(
+                out_pdf,
+                image,
+                x + image_x * scale,
+                top - (image_y + image.height) * scale,
+                width=image.width * scale,
+                height=image.height * scale,
+            )
+
+    with span("diagrams", "draw", count=len(page.diagrams)):
+        for diagram_x, diagram_y, layout in page.diagrams:
+            draw = _DIAGRAM_DRAWERS[page.backend]
+            draw(out_pdf, layout, x + diagram_x * scale, top - diagram_y * scale, scale)
+
+    for is_key, layouts in ((False, page.problem_layer), (True, page.key_layer)):
+        if not layouts:
+            continue
+        draw = _LAYER_DRAWERS[page.backend]
+        with span("layer", "draw", is_key=is_key, count=len(layouts)):
+            begin_layer(out_pdf, is_key)
+            for diagram_x, diagram_y, layout in layouts:
+                draw(
+                    out_pdf,
+                    layout,
+                    x + diagram_x * scale,
+                    top - diagram_y * scale,
+                    scale,
+                    include_board=False,
+                )
+            end_layer(out_pdf)
+
+    if page.texts:
+        with span("text", "draw", count=len(page.texts)):
+            register_fonts()
+            out_pdf.saveState()
+            out_pdf.translate(x, top)
+            out_pdf.scale(scale, -scale)
+            for text, text_x, text_y, text_height_in, rgb in page.texts:
+                draw_text(
+                    out_pdf, text, text_x, text_y, text_height_in, rgb, page.mode
+                )
+            out_pdf.restoreState()
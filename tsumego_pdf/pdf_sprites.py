@@ -0,0 +1,151 @@
+"""
+tsumego_pdf.pdf_sprites.py
+---
+This file contains functionality to draw diagrams on a ReportLab canvas
+as placements of board, stone and mark images,
+which are each embedded only once per document.
+"""
+
+from tsumego_pdf.draw_game.board_graphics import (
+    BOARD_PADDING_PX,
+    convert_to_color_mode,
+    draw_board,
+    drawing_mode,
+    get_sprite,
+    refresh_stone_graphics,
+)
+from tsumego_pdf.pdf_images import draw_image, encode_image
+from tsumego_pdf.pdf_vector import draw_labels
+
+_BILEVEL_MASK_THRESHOLD = 128  # graphics are opaque from this alpha in "1" mode.
+
+# encoded graphics by their style, kept for every document this process writes.
+_ENCODED_SPRITES = {}
+_ENCODED_BOARDS = {}
+
+
+def _encode_sprite(graphic, color_mode: str):
+    """Returns an EncodedImage of an RGBA or LA graphic for the color mode."""
+    if color_mode != "1":
+        return encode_image(graphic)
+
+    # 1-bit pages get 1-bit graphics with hard-edged masks.
+    encoded = encode_image(convert_to_color_mode(graphic.convert("L"), "1"))
+    encoded.mask = encode_image(
+        graphic.getchannel("A").point(
+            lambda v: 255 if v >= _BILEVEL_MASK_THRESHOLD else 0, mode="1"
+        )
+    )
+    return encoded
+
+
+def _get_encoded_sprite(layout, name: str, char: str = None):
+    key = (
+        layout.stone_size_px,
+        layout.solution_mark,
+        layout.outline_thickness_in,
+        layout.color_mode,
+        name,
+        char,
+    )
+    encoded = _ENCODED_SPRITES.get(key)
+    if encoded is None:
+        refresh_stone_graphics(
+            layout.stone_size_px,
+            layout.solution_mark,
+            layout.outline_thickness_in,
+            mode=drawing_mode(layout.color_mode),
+        )
+        encoded = _encode_sprite(get_sprite(name, char), layout.color_mode)
+        _ENCODED_SPRITES[key] = encoded
+
+    return encoded
+
+
+def _get_encoded_board(layout):
+    key = (
+        layout.stone_size_px,
+        layout.line_width_in,
+        layout.star_point_radius_in,
+        layout.board_size,
+        layout.color_mode,
+    )
+    encoded = _ENCODED_BOARDS.get(key)
+    if encoded is None:
+        board, _ = draw_board(
+            stone_size_px=layout.stone_size_px,
+            line_width_in=layout.line_width_in,
+            star_point_radius_in=layout.star_point_radius_in,
+            board_size=layout.board_size,
+            mode=drawing_mode(layout.color_mode),
+        )
+        encoded = encode_image(convert_to_color_mode(board, layout.color_mode))
+        _ENCODED_BOARDS[key] = encoded
+
+    return encoded
+
+
+def draw_diagram_instanced(
+    out_pdf, layout, left, top, scale, include_board: bool = True
+):
+    """
+    Draws the DiagramLayout on the ReportLab canvas
+    as an image of its empty board with its stones, marks and numbers
+    placed on top as separate images.
+
+    Parameters:
+        out_pdf (Canvas): the ReportLab canvas to draw on.
+        layout (DiagramLayout): the diagram to draw.
+        left, top (num): the top-left corner of the diagram (72 DPI).
+        scale (num): the size of one of the layout's pixels (72 DPI).
+        include_board (bool): if False, only what's on the board is drawn,
+                              so it can be put over another diagram.
+    """
+    cell = layout.stone_size_px
+    OFF = BOARD_PADDING_PX
+    crop_left, crop_top, crop_right, crop_bottom = layout.crop_box
+
+    def place(image, x_px, y_px):
+        # (x_px, y_px) is the image's top-left corner on the full board.
+        draw_image(
+            out_pdf,
+            image,
+            left + (x_px - crop_left) * scale,
+            top - (y_px - crop_top + image.height) * scale,
+            width=image.width * scale,
+            height=image.height * scale,
+        )
+
+    def place_on_cell(image, x, y):
+        # graphics are centered on the cell of their board coord.
+        offset = (image.width - cell) // 2
+        place(image, OFF + x * cell - offset, OFF + y * cell - offset)
+
+    # the board is clipped to its crop box.
+    out_pdf.saveState()
+    clip = out_pdf.beginPath()
+    clip.rect(
+        left,
+        top - (crop_bottom - crop_top) * scale,
+        (crop_right - crop_left) * scale,
+        (crop_bottom - crop_top) * scale,
+    )
+    out_pdf.clipPath(clip, stroke=0, fill=0)
+
+    if include_board:
+        place(_get_encoded_board(layout), 0, 0)
+
+    for x, y, is_black in layout.stones:
+        name = "black-stone" if is_black else "white-stone"
+        place_on_cell(_get_encoded_sprite(layout, name), x, y)
+
+    for x, y, is_black in layout.marks:
+        name = "black-mark" if is_black else "white-mark"
+        place_on_cell(_get_encoded_sprite(layout, name), x, y)
+
+    for x, y, char in layout.numbers:
+        place_on_cell(_get_encoded_sprite(layout, "number", char), x, y)
+
+    out_pdf.restoreState()
+
+    draw_labels(out_pdf, layout, left, top, scale)
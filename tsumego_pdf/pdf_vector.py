@@ -0,0 +1,284 @@
+"""
+tsumego_pdf.pdf_vector.py
+---
+This file contains functionality to draw diagrams and pages
+straight onto a ReportLab canvas as paths and text,
+so they're sharp at any print resolution and nothing is rasterized.
+"""
+
+import math
+import threading
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from tsumego_pdf.draw_game.board_graphics import (
+    BOARD_PADDING_PX,
+    DPI,
+    FONT_PATH,
+    LINE_COLOR,
+    NUMS_FONT_PATH,
+    color_in_mode,
+    measure_text,
+)
+from tsumego_pdf.puzzles.playout import BLACK_STONES, STONE_TO_NUM
+
+TEXT_FONT_NAME = "TsumegoText"
+NUMS_FONT_NAME = "TsumegoNums"
+
+_NUM_SCALE = 0.7  # key number height : stone size
+_NUM_CIRCLE_RADIUS = 0.36  # white circle behind a key number : stone size
+
+_FONTS_LOCK = threading.Lock()  # PDFs can be written by threads of one process.
+
+
+def register_fonts():
+    """Registers the bundled fonts with ReportLab if that hasn't been done yet."""
+    with _FONTS_LOCK:
+        if NUMS_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(TEXT_FONT_NAME, FONT_PATH))
+            pdfmetrics.registerFont(TTFont(NUMS_FONT_NAME, NUMS_FONT_PATH))
+
+
+def _set_fill(out_pdf, rgb, color_mode: str):
+    rgb = color_in_mode(rgb, color_mode)
+    if color_mode == "RGB":
+        out_pdf.setFillColorRGB(*(c / 255 for c in rgb))
+    else:
+        out_pdf.setFillGray(rgb[0] / 255)
+
+
+def _set_stroke(out_pdf, rgb, color_mode: str):
+    rgb = color_in_mode(rgb, color_mode)
+    if color_mode == "RGB":
+        out_pdf.setStrokeColorRGB(*(c / 255 for c in rgb))
+    else:
+        out_pdf.setStrokeGray(rgb[0] / 255)
+
+
+def draw_text(out_pdf, text, x, y, text_height_in, rgb, color_mode, is_num=False):
+    """
+    Writes the text where create_text_image(...) would have its image pasted
+    at (x, y), in a coordinate space where y points down.
+    """
+    _, _, font_size, origin_x, baseline_y = measure_text(text, text_height_in, is_num)
+    if font_size == 0:
+        return
+
+    out_pdf.saveState()
+    out_pdf.translate(x + origin_x, y + baseline_y)
+    out_pdf.scale(1, -1)  # so the text isn't upside down.
+    _set_fill(out_pdf, rgb, color_mode)
+    out_pdf.setFont(NUMS_FONT_NAME if is_num else TEXT_FONT_NAME, font_size)
+    out_pdf.drawString(0, 0, text)
+    out_pdf.restoreState()
+
+
+def _draw_board_lines(out_pdf, layout):
+    cell = layout.stone_size_px
+    OFF = BOARD_PADDING_PX
+    board_width, board_height = layout.board_size
+    color_mode = layout.color_mode
+
+    first = OFF + cell / 2
+    last_x = OFF + cell * (board_width - 0.5)
+    last_y = OFF + cell * (board_height - 0.5)
+
+    _set_stroke(out_pdf, LINE_COLOR, color_mode)
+    out_pdf.setLineWidth(max(1, int(layout.line_width_in * DPI)))
+    out_pdf.setLineCap(2)  # the lines overlap where they meet at the corners.
+
+    lines = []
+    for x in range(board_width):
+        draw_x = first + x * cell
+        lines.append((draw_x, first, draw_x, last_y))
+    for y in range(board_height):
+        draw_y = first + y * cell
+        lines.append((first, draw_y, last_x, draw_y))
+    out_pdf.lines(lines)
+
+    # draws the star points.
+    _set_fill(out_pdf, LINE_COLOR, color_mode)
+    radius = layout.star_point_radius_in * DPI
+    path = out_pdf.beginPath()
+    for x, y in layout.star_points:
+        path.circle(first + x * cell, first + y * cell, radius)
+    out_pdf.drawPath(path, stroke=0, fill=1)
+
+
+def _draw_stones(out_pdf, layout):
+    cell = layout.stone_size_px
+    OFF = BOARD_PADDING_PX
+    outline = layout.outline_thickness_in * DPI
+    radius = cell / 2
+
+    # all the stones of one color are drawn as a single path.
+    black_path = out_pdf.beginPath()
+    white_path = out_pdf.beginPath()
+    for x, y, is_black in layout.stones:
+        center_x = OFF + (x + 0.5) * cell
+        center_y = OFF + (y + 0.5) * cell
+        if is_black:
+            black_path.circle(center_x, center_y, radius)
+        else:
+            # the outline is stroked inside the stone's edge.
+            white_path.circle(center_x, center_y, radius - outline / 2)
+
+    out_pdf.setFillGray(0)
+    out_pdf.drawPath(black_path, stroke=0, fill=1)
+
+    out_pdf.setFillGray(1)
+    out_pdf.setStrokeGray(0)
+    out_pdf.setLineWidth(outline)
+    out_pdf.drawPath(white_path, stroke=1, fill=1)
+
+
+def _draw_x_mark(out_pdf, left, top, cell, is_black: bool):
+    def cross(inset):
+        a, b = inset * cell, (1 - inset) * cell
+        return [
+            (left + a, top + a, left + b, top + b),
+            (left + b, top + a, left + a, top + b),
+        ]
+
+    out_pdf.setStrokeGray(0)
+    if is_black:
+        out_pdf.setLineCap(0)
+        out_pdf.setLineWidth(cell * 0.17)
+        out_pdf.lines(cross(0.2))
+    else:
+        # a white cross with a black outline around it.
+        out_pdf.setLineCap(1)
+        out_pdf.setLineWidth(cell * 0.33)
+        out_pdf.lines(cross(0.18))
+        out_pdf.setStrokeGray(1)
+        out_pdf.setLineCap(0)
+        out_pdf.setLineWidth(cell * 0.18)
+        out_pdf.lines(cross(0.2))
+
+
+def _draw_star_mark(out_pdf, left, top, cell):
+    center_x = left + cell * 0.5
+    center_y = top + cell * 0.51
+    outer_radius = cell * 0.33
+    inner_radius = outer_radius * 0.45
+
+    path = out_pdf.beginPath()
+    for i in range(10):
+        radius = outer_radius if i % 2 == 0 else inner_radius
+        angle = math.pi * i / 5
+        point = (center_x + radius * math.sin(angle), center_y - radius * math.cos(angle))
+        if i == 0:
+            path.moveTo(*point)
+        else:
+            path.lineTo(*point)
+    path.close()
+
+    out_pdf.setFillGray(1)
+    out_pdf.setStrokeGray(0)
+    out_pdf.setLineWidth(cell * 0.06)
+    out_pdf.setLineJoin(1)
+    out_pdf.drawPath(path, stroke=1, fill=1)
+
+
+def _draw_marks(out_pdf, layout):
+    cell = layout.stone_size_px
+    OFF = BOARD_PADDING_PX
+    for x, y, is_black in layout.marks:
+        left = OFF + x * cell
+        top = OFF + y * cell
+        if layout.solution_mark == "star":
+            _draw_star_mark(out_pdf, left, top, cell)
+        else:
+            _draw_x_mark(out_pdf, left, top, cell, is_black)
+
+
+def _draw_numbers(out_pdf, layout):
+    cell = layout.stone_size_px
+    OFF = BOARD_PADDING_PX
+    text_height_in = cell / DPI * _NUM_SCALE
+
+    for x, y, char in layout.numbers:
+        left = OFF + x * cell
+        top = OFF + y * cell
+
+        if char in "123456789":
+            # numbers on empty points have a white circle underneath.
+            out_pdf.setFillGray(1)
+            out_pdf.circle(
+                left + cell / 2,
+                top + cell / 2,
+                cell * _NUM_CIRCLE_RADIUS,
+                stroke=0,
+                fill=1,
+            )
+            text, rgb = char, (0, 0, 0)
+        else:
+            text = str(STONE_TO_NUM[char])
+            rgb = (255, 255, 255) if char in BLACK_STONES else (0, 0, 0)
+
+        w, h = measure_text(text, text_height_in, is_num=True)[:2]
+        draw_text(
+            out_pdf,
+            text,
+            left + int((cell - w) / 2),
+            top + int((cell - h) / 2),
+            text_height_in,
+            rgb,
+            layout.color_mode,
+            is_num=True,
+        )
+
+
+def draw_diagram(out_pdf, layout, left, top, scale, include_board: bool = True):
+    """
+    Draws the DiagramLayout on the ReportLab canvas.
+
+    Parameters:
+        out_pdf (Canvas): the ReportLab canvas to draw on.
+        layout (DiagramLayout): the diagram to draw.
+        left, top (num): the top-left corner of the diagram (72 DPI).
+        scale (num): the size of one of the layout's pixels (72 DPI).
+        include_board (bool): if False, only what's on the board is drawn,
+                              so it can be put over another diagram.
+    """
+    register_fonts()
+    crop_left, crop_top, crop_right, crop_bottom = layout.crop_box
+
+    out_pdf.saveState()
+    out_pdf.translate(left, top)
+    out_pdf.scale(scale, -scale)  # y points down like it does in the layout.
+
+    # the board is clipped to its crop box.
+    out_pdf.saveState()
+    clip = out_pdf.beginPath()
+    clip.rect(0, 0, crop_right - crop_left, crop_bottom - crop_top)
+    out_pdf.clipPath(clip, stroke=0, fill=0)
+    out_pdf.translate(-crop_left, -crop_top)
+
+    if include_board:
+        _draw_board_lines(out_pdf, layout)
+    _draw_stones(out_pdf, layout)
+    _draw_marks(out_pdf, layout)
+    _draw_numbers(out_pdf, layout)
+    out_pdf.restoreState()
+    out_pdf.restoreState()
+
+    draw_labels(out_pdf, layout, left, top, scale)
+
+
+def draw_labels(out_pdf, layout, left, top, scale):
+    """
+    Writes the labels of the DiagramLayout as text,
+    with the diagram's top-left corner at (left, top) (72 DPI).
+    """
+    if not layout.labels:
+        return
+
+    register_fonts()
+    out_pdf.saveState()
+    out_pdf.translate(left, top)
+    out_pdf.scale(scale, -scale)
+    for text, x, y, text_height_in in layout.labels:
+        draw_text(
+            out_pdf, text, x, y, text_height_in, layout.text_rgb, layout.color_mode
+        )
+    out_pdf.restoreState()
@@ -1,9 +1,14 @@
+import copy
+import functools
 import multiprocessing
-from functools import partial
+import multiprocessing.pool
+import pickle
+import threading
+from contextlib import nullcontext
+from multiprocessing import resource_tracker, shared_memory
 from datetime import datetime
 import os
 import sys
-import tempfile
 import time
 import numpy as np
 from PIL import Image, ImageDraw
@@ -15,13 +20,54 @@ from tsumego_pdf.draw_game.board_graphics import (
     draw_cover,
 )
 from tsumego_pdf.draw_game.diagram import *
+from tsumego_pdf.pdf_images import encode_image
+from tsumego_pdf.job_events import JobMonitor
+from tsumego_pdf.memory import MemoryReport, peak_rss
+from tsumego_pdf.page_stream import PageStream, render_and_write
+from tsumego_pdf.pdf_pages import PageDrawing
 from tsumego_pdf.puzzles.problems_json import GOKYO_SHUMYO_SECTIONS
+from tsumego_pdf.svg_export import write_pages_to_svg
+from tsumego_pdf.trace import Trace, recording, span
+from tsumego_pdf.workers import available_cpus
 from .write_pdf import *
 
-_MAX_PROCESSES = 16
 _PAGE_NUM_TEXT_SIZE_IN = 1 / 8
 _PAGE_NUM_RGB = (127, 127, 127)
-_counter = multiprocessing.Value("i", 0)  # "i" means it's an integer.
+
+# the most pages each worker can have rendering or waiting to be written.
+_PAGES_PENDING_PER_WORKER = 2
+
+# the ways pages can be put in the PDF:
+# - "raster": diagrams are drawn as images with Pillow
+#             and each one is placed on the page by itself.
+# - "vector": diagrams and text are drawn directly as PDF paths and text.
+# - "instanced": boards, stones and marks are images embedded once
+#                and placed wherever they're used.
+# - "svg": pages are drawn like "vector" and written as SVG files.
+BACKENDS = ("raster", "vector", "instanced", "svg")
+
+# the ways pages can be rendered:
+# - "inline": one after another by the calling thread.
+# - "thread": by a pool of threads of this process.
+# - "process": by a pool of worker processes.
+# - "auto": whichever suits the size of the job.
+EXECUTORS = ("auto", "inline", "thread", "process")
+
+# roughly how long one diagram takes to render with each backend,
+# which tells how long a job will take to render.
+_DIAGRAM_SECONDS = {"raster": 0.02, "vector": 0.002, "instanced": 0.002, "svg": 0.002}
+
+# jobs estimated to take longer than this aren't rendered inline.
+_MAX_INLINE_SECONDS = 0.5
+
+# jobs estimated to take longer than this are worth starting processes for.
+_MAX_THREAD_SECONDS = 3
+
+_diagram_caches = threading.local()  # each worker's own copies of caches.
+_worker_styles = {}  # the JobStyles a worker process last loaded, by name.
+
+_PROBLEM_STYLE_ID = 0
+_KEY_STYLE_ID = 1
 
 
 class DiagramTemplate:
@@ -57,7 +103,6 @@ class DiagramTemplate:
             play_out_solution=False,  # not needed for this process.
         )
 
-        self.lines = problem["lines"]
         width_stones = problem["show-width"]
         height_stones = problem["show-height"]
         self.play_out_solution = play_out_solution
@@ -125,6 +170,38 @@ class PageTemplate:
         self.diagrams = []
         self._diagrams_by_col = {}
 
+    def to_parts(self, job_styles, style_id: int):
+        """
+        Returns (cost, func, DiagramTask) for each diagram of the page
+        in the style of the JobStyles with the given ID,
+        which a worker renders as func(DiagramTask).
+        The cost is the diagram's area, since larger diagrams
+        take longer to draw.
+        """
+        return [
+            (
+                d.size[0] * d.size[1],
+                _render_diagram_task,
+                DiagramTask(
+                    job_styles,
+                    style_id,
+                    (
+                        d.x,
+                        d.y,
+                        d.collection_name,
+                        d.section_name,
+                        d.problem_num,
+                        d.color_to_play,
+                        d.is_random_color,
+                        d.flip_x,
+                        d.flip_y,
+                        d.flip_xy,
+                    ),
+                ),
+            )
+            for d in self.diagrams
+        ]
+
     def paste(self, diagram_template, pos, col):
         diagram_template.x = pos[0]
         diagram_template.y = pos[1]
@@ -162,15 +239,270 @@ class PageTemplate:
                 current_y += spacing
 
 
-def _init_counter(shared_counter):
-    global _counter
-    _counter = shared_counter
+class JobStyles:
+    def __init__(self, styles: dict):
+        """
+        The keyword arguments of _render_diagram(...) by style ID
+        for the diagrams of one job, which every DiagramTask of it refers to.
+        Threads use the styles as they are. Once share() is called,
+        they're pickled into shared memory and only its name is pickled
+        with each task, so each worker process loads them from there
+        the first time it gets a diagram of the job.
+        """
+        self.styles = styles
+        self._memory = None
+
+    def share(self):
+        """Puts the styles in shared memory for worker processes to load."""
+        if self._memory is None:
+            data = pickle.dumps(self.styles)
+            self._memory = shared_memory.SharedMemory(create=True, size=len(data))
+            self._memory.buf[: len(data)] = data
+
+    def close(self):
+        """Frees the shared memory once the job is done with it."""
+        if self._memory is not None:
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+
+    def __reduce__(self):
+        if self._memory is None:
+            return (JobStyles, (self.styles,))
+        return (_load_job_styles, (self._memory.name,))
+
+
+def _load_job_styles(name: str):
+    job_styles = _worker_styles.get(name)
+    if job_styles is None:
+        memory = shared_memory.SharedMemory(name=name)
+        try:
+            job_styles = JobStyles(pickle.loads(memory.buf))
+        finally:
+            memory.close()
+
+        # only the styles of the job being rendered are kept.
+        _worker_styles.clear()
+        _worker_styles[name] = job_styles
+    return job_styles
+
+
+class DiagramTask:
+    __slots__ = ("styles", "style_id", "diagram")
+
+    def __init__(self, styles, style_id: int, diagram: tuple):
+        """
+        What a worker is sent to render a diagram with, which is kept small
+        since one is pickled for every diagram. Everything that's the same
+        for every diagram is in the styles of the job,
+        which each worker process only loads once.
+
+        Parameters:
+            styles (JobStyles): the styles of the job's diagrams.
+            style_id (int): the ID of the style
+                            to render the diagram with.
+            diagram (tuple): (x, y, collection_name, section_name,
+                             problem_num, color_to_play, is_random_color,
+                             flip_x, flip_y, flip_xy) of the diagram,
+                             whose problem is looked up by the worker.
+        """
+        self.styles = styles
+        self.style_id = style_id
+        self.diagram = diagram
+
+    def __reduce__(self):
+        # pickled as its arguments, without the names of its attributes.
+        return (DiagramTask, (self.styles, self.style_id, self.diagram))
+
+
+def _init_worker(warm_up=None):
+    if warm_up is not None:
+        preload_resources(**warm_up)
+
+
+def _render_diagram_task(diagram_task):
+    style = diagram_task.styles.styles[diagram_task.style_id]
+    return _render_diagram(diagram_task, **style)
+
+
+class _InlinePool:
+    def __init__(self, processes=None, initializer=None, initargs=()):
+        """
+        Stands in for a multiprocessing Pool,
+        but runs every task in the calling thread as it's asked for.
+        """
+        if initializer is not None:
+            initializer(*initargs)
+
+    def map(self, func, iterable, chunksize=None):
+        return [func(arg) for arg in iterable]
+
+    def imap_unordered(self, func, iterable):
+        return (func(arg) for arg in iterable)
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+_POOL_CLASSES = {
+    "inline": _InlinePool,
+    "thread": multiprocessing.pool.ThreadPool,
+    "process": multiprocessing.Pool,
+}
 
 
-def _render_page(
-    page_template,
-    num_pages: int,
-    start_time,
+class Renderer:
+    def __init__(
+        self, max_workers: int = None, warm_up: dict = None, executor: str = "process"
+    ):
+        """
+        A pool of workers (processes unless told otherwise)
+        which renders the pages of create_pdf(...).
+        One can be kept open and passed to many create_pdf(...) calls,
+        so the workers only start up once and keep the problems,
+        stone graphics and diagram caches they've loaded between calls.
+
+        It's used as a context manager (or closed with close()):
+            with tsumego_pdf.Renderer() as renderer:
+                tsumego_pdf.create_pdf(selections_a, renderer=renderer)
+                tsumego_pdf.create_pdf(selections_b, renderer=renderer)
+
+        A Renderer renders one create_pdf(...) call at a time.
+
+        Parameters:
+            max_workers (int): the number of workers.
+                               if None, one is used for every CPU
+                               this process is allowed to use.
+            warm_up (dict): if given, the keyword arguments of
+                            preload_resources(...) for the style of
+                            the diagrams, whose problems, fonts and graphics
+                            are loaded before the workers get any pages.
+            executor (str): what the workers are:
+                            - "process": worker processes.
+                            - "thread": threads of this process, which
+                                        start up right away but only draw
+                                        at the same time while Pillow
+                                        doesn't need the interpreter.
+                            - "inline": no workers at all; the pages
+                                        are rendered by the calling thread.
+        """
+        if executor not in _POOL_CLASSES:
+            raise ValueError(
+                f'"{executor}" is not an executor. '
+                f'Use one of: {", ".join(_POOL_CLASSES)}'
+            )
+        if executor == "inline":
+            max_workers = 1
+        elif max_workers is None:
+            max_workers = available_cpus()
+        self.max_workers = max_workers
+        self.executor = executor
+
+        if warm_up is not None and (
+            executor != "process" or multiprocessing.get_start_method() == "fork"
+        ):
+            # the workers are this process or start as copies of it,
+            # so what's loaded here once is shared with all of them.
+            preload_resources(**warm_up)
+            warm_up = None
+
+        if executor == "process":
+            # the workers share this process's resource tracker, so the
+            # shared memory they open isn't counted as leaked when they exit.
+            resource_tracker.ensure_running()
+
+        self._pool = _POOL_CLASSES[executor](
+            processes=max_workers,
+            initializer=_init_worker,
+            initargs=(warm_up,),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _start_job(self, job_styles):
+        """Readies the JobStyles of a job to be sent with its tasks."""
+        if self.executor == "process":
+            job_styles.share()
+
+    def map(self, func, iterable):
+        if self._pool is None:
+            raise ValueError("the Renderer has been closed.")
+        return self._pool.map(func, iterable)
+
+    def map_tasks(self, tasks):
+        """
+        Returns the results of (func, arg) tasks, which may use
+        different functions but are all handed out from a single queue.
+        """
+        return self.map(_run_task, tasks)
+
+    def imap_unordered_tasks(self, tasks):
+        """
+        Yields (index, result) for each of the (func, arg) tasks
+        as soon as it's done, in whatever order they finish.
+        """
+        if self._pool is None:
+            raise ValueError("the Renderer has been closed.")
+        indexed_tasks = ((i, func, arg) for i, (func, arg) in enumerate(tasks))
+        return self._pool.imap_unordered(_run_indexed_task, indexed_tasks)
+
+    def close(self):
+        """Lets the workers finish and shuts them down."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+def _run_task(task):
+    func, arg = task
+    return func(arg)
+
+
+def _run_indexed_task(task):
+    i, func, arg = task
+    return i, func(arg)
+
+
+def _write_and_report(monitor, stage: str, func, pages, *args):
+    """
+    Writes the pages with func(pages, *args)
+    and tells the JobMonitor which files it saved.
+    """
+    start_time = time.time()
+    with recording(monitor.trace):
+        paths = func(pages, *args)
+    monitor.add_output(stage, paths, len(pages), time.time() - start_time)
+
+
+def _choose_executor(num_diagrams: int, backend: str, max_workers: int):
+    """
+    Returns the executor a job of about num_diagrams diagrams is rendered by
+    the soonest, since starting worker processes takes a while
+    and only pays off for jobs that take a while longer.
+    """
+    if max_workers <= 1:
+        return "inline"
+    if num_diagrams is None:
+        return "process"  # the size of the job isn't known.
+
+    seconds = num_diagrams * _DIAGRAM_SECONDS[backend]
+    if seconds <= _MAX_INLINE_SECONDS:
+        return "inline"
+    if seconds <= _MAX_THREAD_SECONDS:
+        return "thread"
+    return "process"
+
+
+def _render_diagram(
+    diagram_task,
     create_key: bool,
     play_out_solution: bool,
     diagram_width_in,
@@ -183,81 +515,193 @@ def _render_page(
     solution_mark: str,
     text_rgb: tuple,
     text_height_in,
-    include_page_num: bool,
     display_width: int,
     write_collection_label: bool,
     outline_thickness_in,
     line_width_in,
     star_point_radius_in,
     ratio_to_flip_xy,
-    bottom_margin,
-    booklet_center_padding_in,
-    verbose,
+    color_mode,
+    backend,
+    key_as_layer,
+    key_text_rgb,
+    diagram_cache,
+    trace: bool,
+    measure_memory: bool,
 ):
-    global _counter
-    page = Image.new(
-        "RGB", (int(page_width_in * DPI), int(page_height_in * DPI)), (255, 255, 255)
+    """
+    Returns a PageDrawing of the page the diagram goes on
+    with only the diagram drawn on it,
+    which is then added to the page by _assemble_page(...),
+    (render_seconds, encode_seconds, cache_hits, cache_misses),
+    which are counted by the calling process,
+    the events of the spans it took if trace is True,
+    and (pid, peak_rss) of the worker if measure_memory is True
+    (otherwise each is None).
+    """
+    start_time = time.perf_counter()
+    encode_start_time = encode_end_time = None
+
+    cache = None
+    if diagram_cache is not None:
+        # each worker (process or thread) keeps its own copy of a cache
+        # between diagrams and counts its lookups, which are then sent back
+        # with the diagram, so the given cache is never counted twice.
+        if not hasattr(_diagram_caches, "by_dir"):
+            _diagram_caches.by_dir = {}
+        cache = _diagram_caches.by_dir.get(diagram_cache.cache_dir)
+        if cache is None:
+            cache = copy.copy(diagram_cache)
+            _diagram_caches.by_dir[diagram_cache.cache_dir] = cache
+        cache.max_bytes = diagram_cache.max_bytes
+        cache.hits = 0
+        cache.misses = 0
+
+    page = PageDrawing(
+        page_width_in * DPI, page_height_in * DPI, color_mode, backend=backend
     )
+    (
+        x,
+        y,
+        collection_name,
+        section_name,
+        problem_num,
+        color_to_play,
+        is_random_color,
+        flip_x,
+        flip_y,
+        flip_xy,
+    ) = diagram_task.diagram
+    diagram_kwargs = dict(
+        problem_num=problem_num,
+        collection_name=collection_name,
+        section_name=section_name,
+        play_out_solution=play_out_solution,
+        color_to_play=color_to_play,
+        is_random_color=is_random_color,
+        flip_xy=flip_xy,
+        flip_x=flip_x,
+        flip_y=flip_y,
+        include_text=include_text,
+        show_problem_num=show_problem_num,
+        force_color_to_play=force_color_to_play,
+        create_key=create_key,
+        draw_sole_solving_stone=draw_sole_solving_stone,
+        solution_mark=solution_mark,
+        text_rgb=text_rgb,
+        text_height_in=text_height_in,
+        display_width=display_width,
+        write_collection_label=write_collection_label,
+        outline_thickness_in=outline_thickness_in,
+        line_width_in=line_width_in,
+        star_point_radius_in=star_point_radius_in,
+        ratio_to_flip_xy=ratio_to_flip_xy,
+        color_mode=color_mode,
+    )
+
+    layout = layout_diagram(diagram_width_in, **diagram_kwargs)
 
-    for diagram_template in page_template.diagrams:
-        diagram = make_diagram(
+    if key_as_layer:
+        # the problem is drawn as usual, except for what the key
+        # covers up, and the rest of the key goes in its own layer.
+        key_layout = layout_diagram(
             diagram_width_in,
-            problem_num=diagram_template.problem_num,
-            collection_name=diagram_template.collection_name,
-            section_name=diagram_template.section_name,
-            play_out_solution=diagram_template.play_out_solution,
-            color_to_play=diagram_template.color_to_play,
-            is_random_color=diagram_template.is_random_color,
-            flip_xy=diagram_template.flip_xy,
-            flip_x=diagram_template.flip_x,
-            flip_y=diagram_template.flip_y,
-            include_text=include_text,
-            show_problem_num=show_problem_num,
-            force_color_to_play=force_color_to_play,
-            create_key=create_key,
-            draw_sole_solving_stone=draw_sole_solving_stone,
-            solution_mark=solution_mark,
-            text_rgb=text_rgb,
-            text_height_in=text_height_in,
-            display_width=display_width,
-            write_collection_label=write_collection_label,
-            outline_thickness_in=outline_thickness_in,
-            line_width_in=line_width_in,
-            star_point_radius_in=star_point_radius_in,
-            ratio_to_flip_xy=ratio_to_flip_xy,
+            **dict(diagram_kwargs, create_key=True, text_rgb=key_text_rgb),
         )
+        layout, problem_only, key_only = split_key_layout(layout, key_layout)
+        page.problem_layer.append((x, y, problem_only))
+        page.key_layer.append((x, y, key_only))
+    layout_end_time = time.perf_counter()
 
-        page.paste(diagram, (diagram_template.x, diagram_template.y))
+    if backend != "raster":
+        page.diagrams.append((x, y, layout))
+    else:
+        # only the board is rasterized,
+        # since the labels are written on the page as text.
+        # the pixels are compressed here in the worker, so the PDF writer
+        # can copy them into the document without decoding anything.
+        diagram = rasterize_diagram(layout, include_labels=False, cache=cache)
+        encode_start_time = time.perf_counter()
+        page.images.append((x, y, encode_image(diagram)))
+        encode_end_time = time.perf_counter()
+
+        for text, text_x, text_y, label_height_in in layout.labels:
+            page.texts.append(
+                (text, x + text_x, y + text_y, label_height_in, layout.text_rgb)
+            )
 
-    if include_page_num:
-        page_num = create_text_image(
-            str(page_template.page_num), _PAGE_NUM_RGB, _PAGE_NUM_TEXT_SIZE_IN
+    end_time = time.perf_counter()
+    encode_seconds = 0
+    if encode_start_time is not None:
+        encode_seconds = encode_end_time - encode_start_time
+    render_seconds = end_time - start_time - encode_seconds
+
+    spans = None
+    if trace:
+        diagram_trace = Trace()
+        diagram_trace.add(
+            "diagram",
+            "render",
+            start_time,
+            end_time,
+            collection=collection_name,
+            section=section_name,
+            problem=problem_num,
+            key=create_key,
         )
+        diagram_trace.add("layout", "render", start_time, layout_end_time)
+        if encode_start_time is not None:
+            diagram_trace.add("rasterize", "render", layout_end_time, encode_start_time)
+            diagram_trace.add("encode", "encode", encode_start_time, encode_end_time)
+        spans = diagram_trace.events
 
-        offset = -(booklet_center_padding_in * DPI / 2)
+    worker_memory = (os.getpid(), peak_rss()) if measure_memory else None
 
-        if page_template.page_num % 2 == 0:
-            offset *= -1
+    if cache is None:
+        stats = (render_seconds, encode_seconds, 0, 0)
+    else:
+        stats = (render_seconds, encode_seconds, cache.hits, cache.misses)
+    return page, stats, spans, worker_memory
 
-        print_x = int((page.size[0] + offset) / 2 - page_num.size[0] / 2)
-        print_y = int(page.size[1] - bottom_margin)
-        page.paste(page_num, (print_x, print_y))
 
-    with tempfile.NamedTemporaryFile(suffix=".png") as temp_file:
-        temp_path = temp_file.name
-    page.save(temp_path)
+def _assemble_page(
+    diagram_pages,
+    page_num: int,
+    page_width_in,
+    page_height_in,
+    color_mode,
+    backend,
+    include_page_num: bool,
+    bottom_margin,
+    booklet_center_padding_in,
+):
+    """
+    Returns the PageDrawing of the page with every one of its diagrams
+    from _render_diagram(...) added to it in order, and its page number.
+    """
+    with span("assemble", "render", page=page_num):
+        page = PageDrawing(
+            page_width_in * DPI, page_height_in * DPI, color_mode, backend=backend
+        )
+        for diagram_page in diagram_pages:
+            page.add(diagram_page)
 
-    with _counter.get_lock():
-        _counter.value += 1
-        percent_done = (_counter.value + 2) / num_pages
-        elapsed = time.time() - start_time
-        avg_duration = elapsed / (_counter.value + 1)
-        remaining_processes = num_pages - (_counter.value + 1)
-        est = remaining_processes * avg_duration
-        if verbose:
-            progress_bar(percent_done, est, prefix="1) Render")
+        if include_page_num:
+            page_num_str = str(page_num)
+            page_num_size = measure_text(page_num_str, _PAGE_NUM_TEXT_SIZE_IN)[:2]
 
-    return temp_path
+            offset = -(booklet_center_padding_in * DPI / 2)
+
+            if page_num % 2 == 0:
+                offset *= -1
+
+            print_x = int((page.size[0] + offset) / 2 - page_num_size[0] / 2)
+            print_y = int(page.size[1] - bottom_margin)
+            page.texts.append(
+                (page_num_str, print_x, print_y, _PAGE_NUM_TEXT_SIZE_IN, _PAGE_NUM_RGB)
+            )
+
+        return page
 
 
 def create_pdf(
@@ -296,9 +740,25 @@ def create_pdf(
     star_point_radius_in=None,
     draw_bbox_around_diagrams: bool = False,
     ratio_to_flip_xy=5 / 6,
+    write_collection_label: bool = None,
+    diagram_cache=None,
+    color_mode: str = "RGB",
+    backend: str = "raster",
+    key_as_layer: bool = False,
+    renderer=None,
+    max_workers: int = None,
+    executor: str = "auto",
+    streaming: bool = False,
+    on_event=None,
+    trace_path: str = None,
+    memory_report: bool = False,
     verbose: bool = True,
 ):
     """
+    Creates the PDFs and returns a JobResult with the paths written,
+    their sizes, the number of pages and diagrams, the diagram cache's
+    hits and misses, and how long each stage of the job took.
+
     Parameters:
         problem_selections (list):
             a list of problems to select.
@@ -401,250 +861,351 @@ def create_pdf(
                         to have its X/Y axes considered possibly randomly flipped.
                         5/6 assumes the bbox of the puzzle's side lengths have a ratio
                         that falls between 5/6 and 6/5.
+        write_collection_label (bool): if True, each label says
+                                       which collection the problem is from.
+                                       if None, labels say so only if
+                                       problems from more than one collection
+                                       are selected (or never if streaming).
+        diagram_cache (DiagramCache): if given, rendered diagrams are reused from
+                                      and saved to this on-disk cache.
+                                      its hit-rate statistics include this job
+                                      once the function returns.
+        color_mode (str): the color depth pages are rendered
+                          and embedded in the PDF with:
+                          - "RGB": full color.
+                          - "L": 8-bit grayscale.
+                          - "1": 1-bit black and white,
+                                 where the gray lines and labels become black.
+        backend (str): how the pages are put in the PDF:
+                       - "raster": diagrams are rendered as images at 288 DPI
+                                   which are each placed on the page,
+                                   so the margins aren't rasterized.
+                                   their labels and the page numbers
+                                   are written as PDF text.
+                       - "vector": diagrams are drawn as PDF paths and
+                                   their labels as PDF text, which is faster
+                                   and smaller, and sharp at any resolution.
+                                   the diagram cache isn't used.
+                       - "instanced": each board, stone and mark graphic
+                                      is embedded once and placed wherever
+                                      it's used, so the PDF's size grows
+                                      with the number of stones rather than
+                                      with the area of the pages.
+                                      the diagram cache isn't used.
+                       - "svg": each page is written as its own SVG file,
+                                named after the output path with its page
+                                number (e.g. "tsumego-1.svg").
+                                booklets can't be made this way.
+        key_as_layer (bool): if True, the key isn't made as a separate PDF.
+                             instead, its marks, numbers, played-out stones
+                             and labels are drawn over the problems
+                             in a layer of the same PDF, which is hidden
+                             until it's turned on in a PDF reader.
+        renderer (Renderer): if given, its worker processes render the pages.
+                             otherwise, a Renderer is opened for this call
+                             and closed once the pages are rendered.
+        max_workers (int): the number of worker processes of the Renderer
+                           opened for this call. if None, one is used for
+                           every CPU this process is allowed to use.
+                           this is ignored if a renderer is given.
+        executor (str): what renders the pages if no renderer is given:
+                        - "auto": whichever suits the size of the job,
+                                  so small jobs don't wait for processes
+                                  to start up.
+                        - "inline": this thread, one page at a time.
+                        - "thread": a pool of threads of this process.
+                        - "process": a pool of worker processes.
+        streaming (bool): if True, problem_selections can be any iterable,
+                          such as a generator, and it's read one selection
+                          at a time as pages are laid out. each page is laid
+                          out, rendered, written and let go of
+                          while the others are in progress, so only a few
+                          pages are ever waiting to be rendered or written
+                          no matter how many problems there are.
+                          the PDF itself is still held in memory by ReportLab
+                          until it's saved, so memory use still grows
+                          with the number of pages. booklets can't be streamed.
+        on_event (function): if given, it's called with a dict for each
+                             event of the job as it happens (see JobMonitor),
+                             such as a stage ending with how long it took
+                             or a diagram being rendered. it's only called
+                             by this process, one event at a time.
+        trace_path (str): if given, how long everything took in every
+                          process and thread is saved to this path
+                          as a Chrome trace (JSON), which can be opened
+                          in Perfetto (https://ui.perfetto.dev). it has spans
+                          for each stage, page, diagram, encoded image,
+                          page written and booklet spread.
+        memory_report (bool): if True, the JobResult has a MemoryReport
+                              of the RSS of this process as each stage
+                              ended, the peak RSS each worker process
+                              has reached, and the lines of code of this
+                              process holding the most memory (found with
+                              tracemalloc, which slows the job down).
         verbose (bool): if True, a progress bar is displayed.
     """
-    global _counter
-    _counter = multiprocessing.Value("i", 0)
-
+    drawing_mode(color_mode)  # raises an error if the color mode is unknown.
+    if backend not in BACKENDS:
+        raise ValueError(
+            f'"{backend}" is not a backend. Use one of: {", ".join(BACKENDS)}'
+        )
+    if executor not in EXECUTORS:
+        raise ValueError(
+            f'"{executor}" is not an executor. Use one of: {", ".join(EXECUTORS)}'
+        )
+    if backend == "svg" and is_booklet:
+        raise ValueError("booklets can't be made with the svg backend.")
+    if streaming and is_booklet:
+        raise ValueError(
+            "booklets can't be streamed, since their first paper "
+            "needs the last page."
+        )
     num_diagrams_made = 0
-    total_diagrams = len(problem_selections)
     if not create_key:
         play_out_solution = False
+        key_as_layer = False
+    separate_key = create_key and not key_as_layer
 
     """
     Step 1) Opens ReportLab to create PDFs.
     """
     start_time = time.time()
+    monitor = JobMonitor(
+        on_event,
+        verbose=verbose,
+        trace=None if trace_path is None else Trace(),
+        memory=MemoryReport() if memory_report else None,
+    )
 
-    now = datetime.now()
-    date_time_str = now.strftime("%Y-%m-%d %H%M%S")
-    if problems_out_path is None:
+    try:
         now = datetime.now()
-        problems_out_path = f"tsumego {date_time_str}.pdf"
+        date_time_str = now.strftime("%Y-%m-%d %H%M%S")
+        if problems_out_path is None:
+            now = datetime.now()
+            problems_out_path = f"tsumego {date_time_str}.pdf"
 
-    if create_key and solutions_out_path is None:
-        solutions_out_path = f"tsumego {date_time_str} key.pdf"
+        if separate_key and solutions_out_path is None:
+            solutions_out_path = f"tsumego {date_time_str} key.pdf"
 
-    if landscape:
-        page_size = (max(page_size), min(page_size))
-    else:
-        page_size = (min(page_size), max(page_size))
+        if landscape:
+            page_size = (max(page_size), min(page_size))
+        else:
+            page_size = (min(page_size), max(page_size))
 
-    pdf_width, pdf_height = page_size
+        pdf_width, pdf_height = page_size
 
-    """
-    Step 2) Retrieves problems.
-    """
-    pdf_width_in, pdf_height_in = page_size[0] / 72, page_size[1] / 72
+        """
+        Step 2) Retrieves problems.
+        """
+        monitor.timed("load", get_problems)
 
-    if is_booklet:
-        page_width_in = (pdf_width_in - booklet_center_padding_in) / 2
-    else:
-        page_width_in = pdf_width_in
-    page_width_in = page_width_in 
-    if is_booklet:
-        page_width_in -= min(margin_in["left"], margin_in["right"])
-    else:
-        page_width_in -= margin_in["left"] + margin_in["right"]
-    page_height_in = pdf_height_in 
+        pdf_width_in, pdf_height_in = page_size[0] / 72, page_size[1] / 72
 
-    w, h = page_width_in * DPI, page_height_in * DPI
+        if is_booklet:
+            page_width_in = (pdf_width_in - booklet_center_padding_in) / 2
+        else:
+            page_width_in = pdf_width_in
+        page_width_in = page_width_in 
+        if is_booklet:
+            page_width_in -= min(margin_in["left"], margin_in["right"])
+        else:
+            page_width_in -= margin_in["left"] + margin_in["right"]
+        page_height_in = pdf_height_in 
 
-    """
-    Step 3) Calculates margins and column variables.
-    """
-    draw_top = True
-    if (
-        draw_bbox_around_diagrams
-        and spacing_below_in < margin_in["top"] + margin_in["bottom"]
-    ):
-        spacing_below_in = margin_in["top"] + margin_in["bottom"]
-        draw_top = num_columns > 1
+        w, h = page_width_in * DPI, page_height_in * DPI
 
-    m_t, m_b = margin_in["top"] * DPI, margin_in["bottom"] * DPI
-    colspan = column_spacing_in * DPI
-    spacing_below = spacing_below_in * DPI
+        """
+        Step 3) Calculates margins and column variables.
+        """
+        draw_top = True
+        if (
+            draw_bbox_around_diagrams
+            and spacing_below_in < margin_in["top"] + margin_in["bottom"]
+        ):
+            spacing_below_in = margin_in["top"] + margin_in["bottom"]
+            draw_top = num_columns > 1
 
-    col_width_in = (page_width_in - column_spacing_in * (num_columns - 1)) / num_columns
-    col_width = col_width_in * DPI
+        m_t, m_b = margin_in["top"] * DPI, margin_in["bottom"] * DPI
+        colspan = column_spacing_in * DPI
+        spacing_below = spacing_below_in * DPI
 
-    stone_size_px = calc_stone_size(col_width_in, display_width)
-    start_x = (w - (stone_size_px * display_width)) / 2 if num_columns == 1 else 0
-    col_x = [int(start_x + i * (col_width + colspan)) for i in range(num_columns)]
+        col_width_in = (
+            page_width_in - column_spacing_in * (num_columns - 1)
+        ) / num_columns
+        col_width = col_width_in * DPI
 
-    num_pages = 1
-    current_col = 0
-    current_y = m_t
+        stone_size_px = calc_stone_size(col_width_in, display_width)
+        start_x = (w - (stone_size_px * display_width)) / 2 if num_columns == 1 else 0
+        col_x = [int(start_x + i * (col_width + colspan)) for i in range(num_columns)]
 
-    """
-    Step 4) Creates blank page templates.
-    """
-    # generates the text image for the page number
-    # to determine how much to change bottom margin.
-    if include_page_num:
-        page_num_img = create_text_image(
-            str(num_pages + 1), _PAGE_NUM_RGB, _PAGE_NUM_TEXT_SIZE_IN
-        )
-        m_b += page_num_img.size[1]
+        num_pages = 1
+        current_col = 0
+        current_y = m_t
 
-    """
-    Step 5) Begins creating diagrams for each problem.
-    """
-    # determines if more than one collection is being used.
-    collection_names = []
-    for selection in problem_selections:
-        collection_name = selection[1]
-        if collection_name not in collection_names:
-            collection_names.append(collection_name)
-
-    write_collection_label = len(collection_names) > 1
-
-    page_templates = []
-    page = PageTemplate(
-        width=int(w),
-        height=int(h),
-        include_page_num=include_page_num,
-        page_num=num_pages,
-    )
-    num_pages += 1
+        """
+        Step 4) Creates blank page templates.
+        """
+        # generates the text image for the page number
+        # to determine how much to change bottom margin.
+        if include_page_num:
+            m_b += measure_text(str(num_pages + 1), _PAGE_NUM_TEXT_SIZE_IN)[1]
 
-    for selection in problem_selections:
-        if len(selection) == 1 and selection.endswith(".sgf"):
-            problem_dict = load_problem_from_sgf(selection)
-        else:
-            problem_num = selection[0]
-            collection_name = selection[1]
-            section_name = None if len(selection) <= 2 else selection[2]
-            problem_dict = get_problem(
-                collection_name,
-                section_name,
-                problem_num,
-                latex_str=None,
-                play_out_solution=play_out_solution,
+        """
+        Step 5) Begins creating diagrams for each problem.
+        """
+        if write_collection_label is None:
+            if streaming:
+                # the selections can only be read once.
+                write_collection_label = False
+            else:
+                # determines if more than one collection is being used.
+                collection_names = []
+                for selection in problem_selections:
+                    collection_name = selection[1]
+                    if collection_name not in collection_names:
+                        collection_names.append(collection_name)
+
+                write_collection_label = len(collection_names) > 1
+
+        def lay_out_pages():
+            # yields each page template as soon as it's been filled,
+            # reading only as many selections as that takes.
+            nonlocal num_pages, current_col, current_y
+
+            page = PageTemplate(
+                width=int(w),
+                height=int(h),
+                include_page_num=include_page_num,
+                page_num=num_pages,
             )
+            num_pages += 1
 
-        # determines how this puzzle will be randomly flipped.
-        flip_xy = random.choice([True, False]) if random_flip else False
-        flip_x = random.choice([True, False]) if random_flip else False
-        flip_y = random.choice([True, False]) if random_flip else False
-
-        if color_to_play == "random":
-            is_random_color = True
-            color_selection = random.choice(["black", "white"])
-        else:
-            is_random_color = False
-            color_selection = color_to_play
-
-        diagram_template = DiagramTemplate(
-            collection_name,
-            section_name,
-            problem_num,
-            flip_x,
-            flip_y,
-            flip_xy,
-            color_selection,
-            is_random_color,
-            ratio_to_flip_xy,
-            stone_size_px,
-            display_width,
-            include_text,
-            text_height_in,
-            play_out_solution,
-        )
+            for selection in problem_selections:
+                if len(selection) == 1 and selection.endswith(".sgf"):
+                    problem_dict = load_problem_from_sgf(selection)
+                else:
+                    problem_num = selection[0]
+                    collection_name = selection[1]
+                    section_name = None if len(selection) <= 2 else selection[2]
+                    problem_dict = get_problem(
+                        collection_name,
+                        section_name,
+                        problem_num,
+                        latex_str=None,
+                        play_out_solution=play_out_solution,
+                    )
 
-        """
-        Step 6) Places diagrams in the templates.
-        """
-        next_y = current_y + diagram_template.size[1]
+                # determines how this puzzle will be randomly flipped.
+                flip_xy = random.choice([True, False]) if random_flip else False
+                flip_x = random.choice([True, False]) if random_flip else False
+                flip_y = random.choice([True, False]) if random_flip else False
 
-        if "block" in placement_method:
-            paste_y = int(stone_size_px * (int(current_y / stone_size_px) + 1))
-        else:
-            paste_y = int(current_y)
-        paste_next_y = paste_y + diagram_template.size[1]
-
-        if paste_next_y > h - m_b:
-
-            # page has been filled.
-            current_col += 1
-            current_y = m_t
-
-            if current_col >= num_columns:
-                if "proportional" in placement_method:
-                    use_block = "block" in placement_method
-                    page.space_diagrams_apart(m_t, h - m_b, use_block, stone_size_px)
-
-                page_templates.append(page)
-                page = PageTemplate(
-                    width=int(w),
-                    height=int(h),
-                    include_page_num=include_page_num,
-                    page_num=num_pages,
+                if color_to_play == "random":
+                    is_random_color = True
+                    color_selection = random.choice(["black", "white"])
+                else:
+                    is_random_color = False
+                    color_selection = color_to_play
+
+                diagram_template = DiagramTemplate(
+                    collection_name,
+                    section_name,
+                    problem_num,
+                    flip_x,
+                    flip_y,
+                    flip_xy,
+                    color_selection,
+                    is_random_color,
+                    ratio_to_flip_xy,
+                    stone_size_px,
+                    display_width,
+                    include_text,
+                    text_height_in,
+                    play_out_solution,
                 )
 
-                num_pages += 1
-                current_col = 0
+                """
+                Step 6) Places diagrams in the templates.
+                """
+                next_y = current_y + diagram_template.size[1]
 
-        if "block" in placement_method:
-            paste_y = int(stone_size_px * (int(current_y / stone_size_px) + 1))
-        else:
-            paste_y = int(current_y)
+                if "block" in placement_method:
+                    paste_y = int(stone_size_px * (int(current_y / stone_size_px) + 1))
+                else:
+                    paste_y = int(current_y)
+                paste_next_y = paste_y + diagram_template.size[1]
+
+                if paste_next_y > h - m_b:
+
+                    # page has been filled.
+                    current_col += 1
+                    current_y = m_t
+
+                    if current_col >= num_columns:
+                        if "proportional" in placement_method:
+                            use_block = "block" in placement_method
+                            page.space_diagrams_apart(
+                                m_t, h - m_b, use_block, stone_size_px
+                            )
+
+                        yield page
+                        page = PageTemplate(
+                            width=int(w),
+                            height=int(h),
+                            include_page_num=include_page_num,
+                            page_num=num_pages,
+                        )
+
+                        num_pages += 1
+                        current_col = 0
+
+                if "block" in placement_method:
+                    paste_y = int(stone_size_px * (int(current_y / stone_size_px) + 1))
+                else:
+                    paste_y = int(current_y)
 
-        paste_x = col_x[current_col]
-        page.paste(diagram_template, (paste_x, paste_y), current_col)
-        current_y += diagram_template.size[1] + spacing_below
+                paste_x = col_x[current_col]
+                page.paste(diagram_template, (paste_x, paste_y), current_col)
+                current_y += diagram_template.size[1] + spacing_below
 
-    if "proportional" in placement_method:
-        use_block = "block" in placement_method
-        page.space_diagrams_apart(m_t, h - m_b, use_block, stone_size_px)
+            if "proportional" in placement_method:
+                use_block = "block" in placement_method
+                page.space_diagrams_apart(m_t, h - m_b, use_block, stone_size_px)
 
-    page_templates.append(page)
+            yield page
 
-    """
-    Step 7) Render pages from their templates using multiprocessing.
-    """
-    total_pages_to_print = num_pages * 2 if create_key else num_pages
-
-    page_render_start = time.time()
-
-    prob_temp_paths = []
-    key_temp_paths = []
-
-    problem_render_page_partial = partial(
-        _render_page,
-        num_pages=total_pages_to_print,
-        start_time=page_render_start,
-        create_key=False,
-        play_out_solution=False,
-        diagram_width_in=col_width_in,
-        page_width_in=page_width_in,
-        page_height_in=page_height_in,
-        include_text=include_text,
-        show_problem_num=show_problem_num,
-        force_color_to_play=force_color_to_play,
-        draw_sole_solving_stone=draw_sole_solving_stone,
-        solution_mark=solution_mark,
-        text_rgb=problem_text_rgb,
-        text_height_in=text_height_in,
-        include_page_num=include_page_num,
-        display_width=display_width,
-        write_collection_label=write_collection_label,
-        outline_thickness_in=outline_thickness_in,
-        line_width_in=line_width_in,
-        star_point_radius_in=star_point_radius_in,
-        ratio_to_flip_xy=ratio_to_flip_xy,
-        bottom_margin=m_b,
-        booklet_center_padding_in=booklet_center_padding_in,
-        verbose=verbose,
-    )
+        if streaming:
+            page_templates = lay_out_pages()
+        else:
+            layout_start_time = time.time()
+            page_templates = list(lay_out_pages())
+            monitor.end_stage(
+                "layout",
+                time.time() - layout_start_time,
+                num_pages=len(page_templates),
+            )
 
-    if create_key:
-        key_render_page_partial = partial(
-            _render_page,
-            start_time=page_render_start,
-            num_pages=total_pages_to_print,
-            create_key=True,
-            play_out_solution=play_out_solution,
+        """
+        Step 7) Prepares to render pages from their templates using multiprocessing.
+        """
+        if streaming:
+            # the number of diagrams isn't known until they've all been laid out.
+            total_diagrams_to_draw = None
+            total_cost = None
+        else:
+            diagrams = [d for t in page_templates for d in t.diagrams]
+            total_diagrams_to_draw = len(diagrams)
+            total_cost = sum(d.size[0] * d.size[1] for d in diagrams)
+            if separate_key:
+                total_diagrams_to_draw *= 2
+                total_cost *= 2
+
+        # the keyword arguments of _render_diagram(...) for each diagram
+        # are only loaded by each worker once.
+        styles = {}
+        styles[_PROBLEM_STYLE_ID] = dict(
+            create_key=False,
+            play_out_solution=play_out_solution,  # for the key's layer.
             diagram_width_in=col_width_in,
             page_width_in=page_width_in,
             page_height_in=page_height_in,
@@ -653,137 +1214,330 @@ def create_pdf(
             force_color_to_play=force_color_to_play,
             draw_sole_solving_stone=draw_sole_solving_stone,
             solution_mark=solution_mark,
-            text_rgb=solution_text_rgb,
+            text_rgb=problem_text_rgb,
             text_height_in=text_height_in,
-            include_page_num=include_page_num,
             display_width=display_width,
             write_collection_label=write_collection_label,
             outline_thickness_in=outline_thickness_in,
             line_width_in=line_width_in,
             star_point_radius_in=star_point_radius_in,
             ratio_to_flip_xy=ratio_to_flip_xy,
+            color_mode=color_mode,
+            backend=backend,
+            key_as_layer=key_as_layer,
+            key_text_rgb=solution_text_rgb,
+            diagram_cache=diagram_cache,
+            trace=trace_path is not None,
+            measure_memory=memory_report,
+        )
+
+        if separate_key:
+            styles[_KEY_STYLE_ID] = dict(
+                create_key=True,
+                play_out_solution=play_out_solution,
+                diagram_width_in=col_width_in,
+                page_width_in=page_width_in,
+                page_height_in=page_height_in,
+                include_text=include_text,
+                show_problem_num=show_problem_num,
+                force_color_to_play=force_color_to_play,
+                draw_sole_solving_stone=draw_sole_solving_stone,
+                solution_mark=solution_mark,
+                text_rgb=solution_text_rgb,
+                text_height_in=text_height_in,
+                display_width=display_width,
+                write_collection_label=write_collection_label,
+                outline_thickness_in=outline_thickness_in,
+                line_width_in=line_width_in,
+                star_point_radius_in=star_point_radius_in,
+                ratio_to_flip_xy=ratio_to_flip_xy,
+                color_mode=color_mode,
+                backend=backend,
+                key_as_layer=False,
+                key_text_rgb=None,
+                diagram_cache=diagram_cache,
+                trace=trace_path is not None,
+                measure_memory=memory_report,
+            )
+
+        job_styles = JobStyles(styles)
+
+        # the diagrams are put together into their pages by this process.
+        page_style = dict(
+            page_width_in=page_width_in,
+            page_height_in=page_height_in,
+            color_mode=color_mode,
+            backend=backend,
+            include_page_num=include_page_num,
             bottom_margin=m_b,
             booklet_center_padding_in=booklet_center_padding_in,
-            verbose=verbose,
         )
 
-        with (
-            multiprocessing.Pool(
-                processes=_MAX_PROCESSES,
-                initializer=_init_counter,
-                initargs=(_counter,),
-            ) as pool_a,
-            multiprocessing.Pool(
-                processes=_MAX_PROCESSES,
-                initializer=_init_counter,
-                initargs=(_counter,),
-            ) as pool_b,
-        ):
-            # maps the partial function to the list of PageTemplate objects.
-            prob_temp_paths = pool_a.map(problem_render_page_partial, page_templates)
-            key_temp_paths = pool_b.map(key_render_page_partial, page_templates)
-    else:
-        with multiprocessing.Pool(
-            processes=_MAX_PROCESSES,
-            initializer=_init_counter,
-            initargs=(_counter,),
-        ) as pool:
-            # maps the partial function to the list of PageTemplate objects.
-            prob_temp_paths = pool.map(problem_render_page_partial, page_templates)
-
-    if verbose:
-        sys.stdout.write("\r" + " " * 80)
-        sys.stdout.flush()
-        sys.stdout.write("\r")
+        def page_to_render(stream, i, page_template, style_id):
+            assemble = functools.partial(
+                _assemble_page, page_num=page_template.page_num, **page_style
+            )
+            return (stream, i, page_template.to_parts(job_styles, style_id), assemble)
 
-    """
-    Step 8) The temporary images are used to create the PDFs.
-    """
-    prob_process = None
-    key_process = None
-    if is_booklet:
-        prob_process = multiprocessing.Process(
-            target=write_images_to_booklet_pdf,
-            args=(
-                prob_temp_paths,
-                problems_out_path,
-                page_size,
-                booklet_center_padding_in,
+        """
+        Step 8) The pages are used to create the PDFs as soon as they're rendered.
+        """
+        num_page_templates = None if streaming else len(page_templates)
+        prob_pages = PageStream(num_page_templates)
+        key_pages = PageStream(num_page_templates) if separate_key else None
+
+        # the writers are quiet, since the render progress bar is being shown
+        # while they write.
+        if backend == "svg":
+            # SVGs are quick to write, so they're written by threads of this process.
+            writers = [(write_pages_to_svg, (prob_pages, problems_out_path))]
+            if separate_key:
+                writers.append((write_pages_to_svg, (key_pages, solutions_out_path)))
+
+        elif is_booklet:
+            writers = [
+                (
+                    write_images_to_booklet_pdf,
+                    (
+                        prob_pages,
+                        problems_out_path,
+                        page_size,
+                        booklet_center_padding_in,
+                        True,
+                        booklet_cover,
+                        embed_cover_in_signatures,
+                        num_signatures,
+                        False,  # verbose.
+                        color_mode,
+                    ),
+                )
+            ]
+            prob_order = booklet_page_order(
+                num_page_templates,
                 True,
-                booklet_cover,
+                booklet_cover is not None,
                 embed_cover_in_signatures,
                 num_signatures,
-                verbose and not create_key,  # not verbose if key is.
-            ),
-        )
+            )
 
-        if create_key:
-            key_process = multiprocessing.Process(
-                target=write_images_to_booklet_pdf,
-                args=(
-                    key_temp_paths,
-                    solutions_out_path,
-                    page_size,
-                    booklet_center_padding_in,
+            if separate_key:
+                writers.append(
+                    (
+                        write_images_to_booklet_pdf,
+                        (
+                            key_pages,
+                            solutions_out_path,
+                            page_size,
+                            booklet_center_padding_in,
+                            booklet_key_in_printers_spread,
+                            booklet_cover,
+                            embed_cover_in_signatures,
+                            num_signatures,
+                            False,  # verbose.
+                            color_mode,
+                        ),
+                    )
+                )
+                key_order = booklet_page_order(
+                    num_page_templates,
                     booklet_key_in_printers_spread,
-                    booklet_cover,
+                    booklet_cover is not None,
                     embed_cover_in_signatures,
                     num_signatures,
-                    verbose,  # verbose.
-                ),
-            )
+                )
 
-    else:
-        prob_process = multiprocessing.Process(
-            target=write_images_to_pdf,
-            args=(
-                prob_temp_paths,
-                problems_out_path,
-                page_size,
-                not create_key,  # not verbose if key is.
-            ),
-        )
+        else:
+            writers = [
+                (
+                    write_images_to_pdf,
+                    (prob_pages, problems_out_path, page_size, False),
+                )
+            ]
+            if separate_key:
+                writers.append(
+                    (
+                        write_images_to_pdf,
+                        (key_pages, solutions_out_path, page_size, False),
+                    )
+                )
 
-        if create_key:
-            key_process = multiprocessing.Process(
-                target=write_images_to_pdf,
-                args=(
-                    key_temp_paths,
-                    solutions_out_path,
-                    page_size,
-                    True,  # verbose.
-                ),
+        def stream_pages():
+            # each page is only laid out once there's room for it to be rendered,
+            # and the PDFs end once the selections have run out.
+            num_laid_out = 0
+            while True:
+                layout_start_time = time.time()
+                page_template = next(page_templates, None)
+                monitor.add_seconds("layout", time.time() - layout_start_time)
+                if page_template is None:
+                    break
+
+                i = num_laid_out
+                yield page_to_render(prob_pages, i, page_template, _PROBLEM_STYLE_ID)
+                if separate_key:
+                    yield page_to_render(key_pages, i, page_template, _KEY_STYLE_ID)
+                num_laid_out += 1
+
+            prob_pages.end(num_laid_out)
+            if separate_key:
+                key_pages.end(num_laid_out)
+
+        # the pages are rendered in the order they're written,
+        # taking turns between the problems and the key so both PDFs keep going.
+        if streaming:
+            pages_to_render = stream_pages()
+        else:
+            if not is_booklet:
+                prob_order = key_order = range(num_page_templates)
+            pages_to_render = [
+                page_to_render(prob_pages, i, page_templates[i], _PROBLEM_STYLE_ID)
+                for i in prob_order
+            ]
+            if separate_key:
+                key_pages_to_render = [
+                    page_to_render(key_pages, i, page_templates[i], _KEY_STYLE_ID)
+                    for i in key_order
+                ]
+                pages_to_render = [
+                    page
+                    for pair in zip(pages_to_render, key_pages_to_render)
+                    for page in pair
+                ]
+        streams = [prob_pages] if key_pages is None else [prob_pages, key_pages]
+
+        # each writer tells the monitor what it saved once it's done.
+        write_stage = "impose" if is_booklet else "write"
+        writers = [
+            (_write_and_report, (monitor, write_stage, func) + tuple(args))
+            for func, args in writers
+        ]
+
+        def count_diagram(cost, result):
+            page, stats, spans, worker_memory = result
+            monitor.diagram_done(cost, stats, spans, worker_memory)
+            return page
+
+        # a Renderer which wasn't given is only kept open for this call,
+        # and its workers are readied for this call's diagrams.
+        if renderer is not None:
+            renderer_context = nullcontext(renderer)
+        else:
+            renderer_start_time = time.time()
+            warm_up = {"color_mode": color_mode}
+            if backend == "raster":
+                # only rasterized diagrams are drawn with the stone graphics.
+                warm_up.update(
+                    stone_size_px=stone_size_px,
+                    solution_mark=solution_mark,
+                    outline_thickness_in=outline_thickness_in,
+                )
+
+            if executor == "auto":
+                if streaming:
+                    num_diagrams = (
+                        len(problem_selections)
+                        if hasattr(problem_selections, "__len__")
+                        else None
+                    )
+                else:
+                    num_diagrams = sum(len(t.diagrams) for t in page_templates)
+                if num_diagrams is not None and separate_key:
+                    num_diagrams *= 2
+                executor = _choose_executor(
+                    num_diagrams,
+                    backend,
+                    available_cpus() if max_workers is None else max_workers,
+                )
+            renderer_context = Renderer(
+                max_workers, warm_up=warm_up, executor=executor
+            )
+            monitor.end_stage(
+                "start",
+                time.time() - renderer_start_time,
+                executor=executor,
+                max_workers=renderer_context.max_workers,
             )
 
-    if key_process is not None:
-        prob_process.start()
-        key_process.start()
-        prob_process.join()
-        key_process.join()
-    else:
-        prob_process.start()
-        prob_process.join()
+        # the pages are put together by this thread, which records its spans.
+        with recording(monitor.trace), renderer_context as renderer:
+            renderer._start_job(job_styles)
+            try:
+                monitor.start_render(total_diagrams_to_draw, total_cost)
+                render_and_write(
+                    renderer,
+                    pages_to_render,
+                    streams,
+                    writers,
+                    max_pending=renderer.max_workers * _PAGES_PENDING_PER_WORKER,
+                    on_result=count_diagram,
+                )
+            finally:
+                job_styles.close()
+
+        result = monitor.result
+        if streaming:
+            monitor.end_stage("layout", num_pages=len(prob_pages))
+        monitor.end_stage(
+            "render",
+            num_diagrams=result.num_diagrams,
+            cache_hits=result.cache_hits,
+            cache_misses=result.cache_misses,
+        )
+        if "encode" in result.stage_seconds:
+            monitor.end_stage("encode", num_images=result.num_diagrams)
+        monitor.end_stage(write_stage, num_pages=len(prob_pages))
 
-    """
-    Step 9) Deletes resources and prints out a conclusive message.
-    """
-    for path in prob_temp_paths:
-        os.remove(path)
+        if verbose:
+            sys.stdout.write("\r" + " " * 80)
+            sys.stdout.flush()
+            sys.stdout.write("\r")
+
+        if diagram_cache is not None:
+            diagram_cache.hits += result.cache_hits
+            diagram_cache.misses += result.cache_misses
+            if verbose:
+                lookups = result.cache_hits + result.cache_misses
+                hit_rate = result.cache_hits / lookups if lookups > 0 else 0
+                print(
+                    f"Diagram cache: {result.cache_hits} hits, "
+                    f"{result.cache_misses} misses ({hit_rate * 100:.1f}% hit rate)."
+                )
 
-    for path in key_temp_paths:
-        os.remove(path)
+        if backend == "svg":
+            problems_out_path = os.path.splitext(problems_out_path)[0] + "-*.svg"
+            if separate_key:
+                solutions_out_path = os.path.splitext(solutions_out_path)[0] + "-*.svg"
 
-    sys.stdout.write("\r" + " " * 80)
-    sys.stdout.flush()
-    sys.stdout.write("\r")
+        """
+        Step 9) Prints out a conclusive message.
+        """
+        sys.stdout.write("\r" + " " * 80)
+        sys.stdout.flush()
+        sys.stdout.write("\r")
 
-    if verbose:
-        if create_key:
-            print(
-                "A collection of tsumego and its key have been saved to "
-                f'"{problems_out_path}" and "{solutions_out_path}".\n'
-            )
-        else:
-            print(
-                "A collection of tsumego has been " f'saved to "{problems_out_path}".\n'
-            )
+        if verbose:
+            if key_as_layer:
+                print(
+                    "A collection of tsumego with its key as a layer has been "
+                    f'saved to "{problems_out_path}".\n'
+                )
+            elif create_key:
+                print(
+                    "A collection of tsumego and its key have been saved to "
+                    f'"{problems_out_path}" and "{solutions_out_path}".\n'
+                )
+            else:
+                print(
+                    "A collection of tsumego has been "
+                    f'saved to "{problems_out_path}".\n'
+                )
+
+        result.problems_out_path = problems_out_path
+        result.solutions_out_path = solutions_out_path if separate_key else None
+        result.num_pages = len(prob_pages)
+        if trace_path is not None:
+            monitor.trace.write(trace_path)
+        return monitor.finish()
+    finally:
+        # Python's allocations aren't traced past the job, even if it fails.
+        monitor.close()
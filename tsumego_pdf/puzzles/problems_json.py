@@ -232,9 +232,19 @@ def get_problem(
     if play_out_solution and num_solutions == 1:
         lines = give_resulting_board(lines, default_to_play)
 
+    # problems usually only list the rows near the top edge,
+    # so the board is assumed to be square unless its bottom edge is given.
+    board_width = max(len(line) for line in lines)
+    if any(c in ",)." for c in lines[-1]):
+        board_height = len(lines)
+    else:
+        board_height = max(len(lines), board_width)
+
     return {
         "show-width": max_x + 1,  # how many stones wide.
         "show-height": max_y + 1,  # how many stones high.
+        "board-width": board_width,
+        "board-height": board_height,
         "lines": lines,
         "default-to-play": default_to_play,
     }
@@ -0,0 +1,370 @@
+"""
+tsumego_pdf.svg_export.py
+---
+This file contains functionality to write diagrams and pages as SVG,
+using the same DiagramLayout the PDF backends draw.
+
+Each kind of stone, mark and number is defined once in the SVG's <defs>
+and placed with <use>, so an SVG of a diagram is only a few kilobytes.
+"""
+
+import math
+import os
+from xml.sax.saxutils import escape
+from tsumego_pdf.draw_game.board_graphics import (
+    BOARD_PADDING_PX,
+    DPI,
+    LINE_COLOR,
+    color_in_mode,
+    measure_text,
+)
+from tsumego_pdf.draw_game.diagram import layout_diagram
+from tsumego_pdf.pdf_vector import _NUM_CIRCLE_RADIUS, _NUM_SCALE
+from tsumego_pdf.puzzles.playout import BLACK_STONES, STONE_TO_NUM
+from tsumego_pdf.trace import span
+
+# the bundled fonts aren't embedded, so these are what the SVG asks for.
+_TEXT_FONT = "'Charis SIL', Georgia, serif"
+_NUMS_FONT = "'LT Museum', Verdana, sans-serif"
+
+
+def _num(value):
+    """Returns the number as short as it can be written in the SVG."""
+    text = f"{value:.2f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def _hex(rgb, color_mode: str):
+    return "#%02x%02x%02x" % tuple(color_in_mode(rgb, color_mode))
+
+
+def _text(text, x, y, text_height_in, rgb, color_mode: str, is_num=False):
+    """
+    Returns a <text> element which sits where create_text_image(...)
+    would have its image pasted at (x, y).
+    """
+    _, _, font_size, origin_x, baseline_y = measure_text(text, text_height_in, is_num)
+    if font_size == 0:
+        return ""
+
+    font = _NUMS_FONT if is_num else _TEXT_FONT
+    style = ' font-weight="bold"' if is_num else ' font-style="italic"'
+    return (
+        f'<text x="{_num(x + origin_x)}" y="{_num(y + baseline_y)}" '
+        f'font-family="{font}" font-size="{_num(font_size)}"{style} '
+        f'fill="{_hex(rgb, color_mode)}">{escape(text)}</text>'
+    )
+
+
+def _x_mark(cell, is_black: bool):
+    def cross(inset):
+        a, b = _num(inset * cell), _num((1 - inset) * cell)
+        return f"M{a} {a}L{b} {b}M{b} {a}L{a} {b}"
+
+    if is_black:
+        return (
+            f'<path d="{cross(0.2)}" stroke="#000" '
+            f'stroke-width="{_num(cell * 0.17)}"/>'
+        )
+
+    # a white cross with a black outline around it.
+    return (
+        f'<path d="{cross(0.18)}" stroke="#000" stroke-linecap="round" '
+        f'stroke-width="{_num(cell * 0.33)}"/>'
+        f'<path d="{cross(0.2)}" stroke="#fff" '
+        f'stroke-width="{_num(cell * 0.18)}"/>'
+    )
+
+
+def _star_mark(cell):
+    center_x = cell * 0.5
+    center_y = cell * 0.51
+    outer_radius = cell * 0.33
+    inner_radius = outer_radius * 0.45
+
+    points = []
+    for i in range(10):
+        radius = outer_radius if i % 2 == 0 else inner_radius
+        angle = math.pi * i / 5
+        points.append(
+            f"{_num(center_x + radius * math.sin(angle))},"
+            f"{_num(center_y - radius * math.cos(angle))}"
+        )
+
+    return (
+        f'<polygon points="{" ".join(points)}" fill="#fff" stroke="#000" '
+        f'stroke-width="{_num(cell * 0.06)}" stroke-linejoin="round"/>'
+    )
+
+
+def _number(cell, char, color_mode: str):
+    elements = []
+    text_height_in = cell / DPI * _NUM_SCALE
+    if char in "123456789":
+        # numbers on empty points have a white circle underneath.
+        elements.append(
+            f'<circle cx="{_num(cell / 2)}" cy="{_num(cell / 2)}" '
+            f'r="{_num(cell * _NUM_CIRCLE_RADIUS)}" fill="#fff"/>'
+        )
+        text, rgb = char, (0, 0, 0)
+    else:
+        text = str(STONE_TO_NUM[char])
+        rgb = (255, 255, 255) if char in BLACK_STONES else (0, 0, 0)
+
+    w, h = measure_text(text, text_height_in, is_num=True)[:2]
+    elements.append(
+        _text(
+            text,
+            int((cell - w) / 2),
+            int((cell - h) / 2),
+            text_height_in,
+            rgb,
+            color_mode,
+            is_num=True,
+        )
+    )
+    return "".join(elements)
+
+
+def _define(defs: dict, layout, name: str, char: str = None):
+    """
+    Adds the graphic to the defs if it isn't there yet and returns its id.
+    Graphics are drawn with their cell's top-left corner at (0, 0).
+    """
+    cell = layout.stone_size_px
+    if name in ("b", "w"):
+        outline = layout.outline_thickness_in * DPI
+        def_id = f"{name}{cell}-{_num(outline)}"
+    elif name == "n":
+        def_id = f"n{cell}-{ord(char)}"
+    else:
+        def_id = f"{name}{cell}"
+
+    if def_id in defs:
+        return def_id
+
+    half = _num(cell / 2)
+    if name == "b":
+        graphic = f'<circle cx="{half}" cy="{half}" r="{half}"/>'
+    elif name == "w":
+        # the outline is stroked inside the stone's edge.
+        graphic = (
+            f'<circle cx="{half}" cy="{half}" r="{_num(cell / 2 - outline / 2)}" '
+            f'fill="#fff" stroke="#000" stroke-width="{_num(outline)}"/>'
+        )
+    elif name == "xb":
+        graphic = _x_mark(cell, is_black=True)
+    elif name == "xw":
+        graphic = _x_mark(cell, is_black=False)
+    elif name == "s":
+        graphic = _star_mark(cell)
+    else:
+        graphic = _number(cell, char, layout.color_mode)
+
+    defs[def_id] = f'<g id="{def_id}">{graphic}</g>'
+    return def_id
+
+
+def _board_lines(layout):
+    cell = layout.stone_size_px
+    OFF = BOARD_PADDING_PX
+    board_width, board_height = layout.board_size
+    color = _hex(LINE_COLOR, layout.color_mode)
+
+    first = OFF + cell / 2
+    last_x = OFF + cell * (board_width - 0.5)
+    last_y = OFF + cell * (board_height - 0.5)
+
+    # only the lines inside the crop box are written.
+    crop_left, crop_top, crop_right, crop_bottom = layout.crop_box
+    top, bottom = _num(max(first, crop_top)), _num(min(last_y, crop_bottom))
+    left, right = _num(max(first, crop_left)), _num(min(last_x, crop_right))
+
+    path = []
+    for x in range(board_width):
+        draw_x = first + x * cell
+        if crop_left <= draw_x <= crop_right:
+            path.append(f"M{_num(draw_x)} {top}V{bottom}")
+    for y in range(board_height):
+        draw_y = first + y * cell
+        if crop_top <= draw_y <= crop_bottom:
+            path.append(f"M{left} {_num(draw_y)}H{right}")
+
+    elements = [
+        f'<path d="{"".join(path)}" stroke="{color}" '
+        f'stroke-width="{max(1, int(layout.line_width_in * DPI))}" '
+        f'stroke-linecap="square"/>'
+    ]
+
+    radius = _num(layout.star_point_radius_in * DPI)
+    for x, y in layout.star_points:
+        draw_x, draw_y = first + x * cell, first + y * cell
+        if crop_left <= draw_x <= crop_right and crop_top <= draw_y <= crop_bottom:
+            elements.append(
+                f'<circle cx="{_num(draw_x)}" cy="{_num(draw_y)}" '
+                f'r="{radius}" fill="{color}"/>'
+            )
+
+    return elements
+
+
+def _diagram_elements(
+    defs: dict,
+    layout,
+    x,
+    y,
+    include_board: bool = True,
+    include_labels: bool = True,
+):
+    """
+    Returns the SVG elements of the DiagramLayout
+    with its top-left corner at (x, y).
+    """
+    cell = layout.stone_size_px
+    OFF = BOARD_PADDING_PX
+    crop_left, crop_top, crop_right, crop_bottom = layout.crop_box
+    crop_w, crop_h = crop_right - crop_left, crop_bottom - crop_top
+
+    def use(def_id, board_x, board_y):
+        left, top = OFF + board_x * cell, OFF + board_y * cell
+        if (
+            left >= crop_right
+            or top >= crop_bottom
+            or left + cell <= crop_left
+            or top + cell <= crop_top
+        ):
+            return ""  # the cell is cropped out.
+        return f'<use href="#{def_id}" x="{left}" y="{top}"/>'
+
+    # the board is clipped to its crop box.
+    clip_id = f"c{crop_left}-{crop_top}-{crop_w}-{crop_h}"
+    if clip_id not in defs:
+        defs[clip_id] = (
+            f'<clipPath id="{clip_id}"><rect x="{crop_left}" y="{crop_top}" '
+            f'width="{crop_w}" height="{crop_h}"/></clipPath>'
+        )
+    board = [
+        f'<g transform="translate({_num(x - crop_left)} {_num(y - crop_top)})" '
+        f'clip-path="url(#{clip_id})">'
+    ]
+    if include_board:
+        board.extend(_board_lines(layout))
+
+    for stone_x, stone_y, is_black in layout.stones:
+        name = "b" if is_black else "w"
+        board.append(use(_define(defs, layout, name), stone_x, stone_y))
+
+    for mark_x, mark_y, is_black in layout.marks:
+        if layout.solution_mark == "star":
+            name = "s"
+        else:
+            name = "xb" if is_black else "xw"
+        board.append(use(_define(defs, layout, name), mark_x, mark_y))
+
+    for num_x, num_y, char in layout.numbers:
+        board.append(use(_define(defs, layout, "n", char), num_x, num_y))
+
+    board.append("</g>")
+    if not include_labels:
+        return board
+
+    for text, text_x, text_y, text_height_in in layout.labels:
+        board.append(
+            _text(
+                text,
+                x + text_x,
+                y + text_y,
+                text_height_in,
+                layout.text_rgb,
+                layout.color_mode,
+            )
+        )
+
+    return board
+
+
+def _svg_document(width, height, defs: dict, elements: list):
+    defs_str = f"<defs>{''.join(defs.values())}</defs>" if defs else ""
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" '
+        f'width="{_num(width / DPI)}in" height="{_num(height / DPI)}in" '
+        f'viewBox="0 0 {width} {height}">'
+        f'{defs_str}{"".join(elements)}</svg>'
+    )
+
+
+def diagram_to_svg(layout, include_labels: bool = True):
+    """
+    Returns the DiagramLayout as the text of an SVG file,
+    which is the size the diagram would be printed at.
+    """
+    defs = {}
+    elements = _diagram_elements(defs, layout, 0, 0, include_labels=include_labels)
+    if include_labels:
+        width, height = layout.size
+    else:
+        crop_left, crop_top, crop_right, crop_bottom = layout.crop_box
+        width, height = crop_right - crop_left, crop_bottom - crop_top
+
+    return _svg_document(width, height, defs, elements)
+
+
+def make_diagram_svg(diagram_width_in, include_labels: bool = True, **kwargs):
+    """
+    Returns the text of an SVG file of a Life and Death diagram.
+    The parameters are the same as make_diagram(...),
+    except there's no diagram cache since SVGs are quick to make.
+    """
+    layout = layout_diagram(diagram_width_in, **kwargs)
+    return diagram_to_svg(layout, include_labels)
+
+
+def page_to_svg(page):
+    """
+    Returns the PageDrawing as the text of an SVG file.
+    The key's layer, if the page has one, is a group with the id "answer-key"
+    which is hidden until its display is set,
+    and what the key covers up is the group with the id "problem-only".
+    """
+    if page.images:
+        raise ValueError("pages with rasterized diagrams can't be written as SVG.")
+
+    defs = {}
+    elements = [f'<rect width="{page.width}" height="{page.height}" fill="#fff"/>']
+    for x, y, layout in page.diagrams:
+        elements.extend(_diagram_elements(defs, layout, x, y))
+
+    for group_attributes, layouts in (
+        ('id="problem-only"', page.problem_layer),
+        ('id="answer-key" display="none"', page.key_layer),
+    ):
+        if layouts:
+            elements.append(f"<g {group_attributes}>")
+            for x, y, layout in layouts:
+                elements.extend(
+                    _diagram_elements(defs, layout, x, y, include_board=False)
+                )
+            elements.append("</g>")
+
+    for text, x, y, text_height_in, rgb in page.texts:
+        elements.append(_text(text, x, y, text_height_in, rgb, page.mode))
+
+    return _svg_document(page.width, page.height, defs, elements)
+
+
+def write_pages_to_svg(pages, out_path: str):
+    """
+    Writes each PageDrawing to its own SVG file named after out_path
+    (e.g. "tsumego.svg" becomes "tsumego-1.svg", "tsumego-2.svg", ...)
+    and returns the paths of the files.
+    """
+    root = os.path.splitext(out_path)[0]
+    paths = []
+    for i, page in enumerate(pages):
+        path = f"{root}-{i + 1}.svg"
+        with span("page", "write", page=i + 1):
+            with open(path, "w", encoding="utf-8") as out_file:
+                out_file.write(page_to_svg(page))
+        paths.append(path)
+
+    return paths
@@ -0,0 +1,150 @@
+"""
+tsumego_pdf.trace.py
+---
+This file contains functionality to record how long each part
+of making a PDF takes in every process and thread,
+and to save it as a Chrome trace (which can be opened in Perfetto),
+so stragglers and idle workers or writers can be seen.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()  # the Trace each thread records its spans to.
+
+
+class Trace:
+    def __init__(self):
+        """
+        The spans recorded while making a PDF, as Chrome trace events.
+        Spans can be added to it by any thread of the process,
+        and the spans of other processes can be added with extend(...).
+        """
+        self.events = []
+        self.thread_names = {}  # the names of the threads by (pid, tid).
+
+    def add(self, name: str, category: str, start, end, **args):
+        """
+        Adds a span of this thread
+        which began and ended at the given times of time.perf_counter(),
+        which is the same clock in every process of the machine.
+        """
+        self.events.append(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": args,
+            }
+        )
+
+    def add_async(self, name: str, category: str, span_id: int, start, end, **args):
+        """
+        Adds a span like add(...) does, but which is shown on a track of
+        its own, so it can overlap the other spans of this thread.
+        """
+        for phase, ts in (("b", start), ("e", end)):
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": phase,
+                    "id": span_id,
+                    "ts": ts * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_native_id(),
+                    "args": args if phase == "b" else {},
+                }
+            )
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        """Adds a span of this thread that lasts as long as the context."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, time.perf_counter(), **args)
+
+    def extend(self, events: list):
+        """Adds the spans recorded by another Trace, such as a worker's."""
+        self.events.extend(events)
+
+    def write(self, out_path: str):
+        """Saves the spans as a Chrome trace JSON file."""
+        main_pid = os.getpid()
+        metadata = []
+        for pid in sorted({event["pid"] for event in self.events} | {main_pid}):
+            name = "tsumego_pdf" if pid == main_pid else f"worker {pid}"
+            metadata.append(
+                {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}
+            )
+        for (pid, tid), name in self.thread_names.items():
+            metadata.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+
+        with open(out_path, "w", encoding="utf-8") as out_file:
+            json.dump(
+                {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"},
+                out_file,
+            )
+
+
+@contextmanager
+def recording(trace):
+    """
+    Records the spans of this thread made with span(...) to the Trace
+    while in the context. If trace is None, nothing is recorded.
+    """
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    if trace is not None:
+        thread = threading.current_thread()
+        trace.thread_names[(os.getpid(), threading.get_native_id())] = thread.name
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def span(name: str, category: str, **args):
+    """
+    Adds a span that lasts as long as the context to the Trace
+    this thread is recording to, if there is one.
+    """
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, category, start, time.perf_counter(), **args)
+
+
+def add_async_span(name: str, category: str, span_id: int, start, end, **args):
+    """
+    Adds a span which began and ended at the given times of time.perf_counter()
+    on a track of its own to the Trace this thread is recording to,
+    if there is one.
+    """
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.add_async(name, category, span_id, start, end, **args)
@@ -0,0 +1,60 @@
+"""
+tsumego_pdf.workers.py
+---
+This file contains functionality to size pools of worker processes
+to the CPUs this process is actually allowed to use.
+"""
+
+import math
+import os
+
+_CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+_CGROUP_V1_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+_CGROUP_V1_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+def _read_file(path: str):
+    with open(path, "r") as in_file:
+        return in_file.read().strip()
+
+
+def _cgroup_cpu_limit():
+    """
+    Returns the number of CPUs the container's cgroup quota allows,
+    or None if there's no quota.
+    """
+    try:
+        quota, period = _read_file(_CGROUP_V2_CPU_MAX).split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    try:
+        quota = int(_read_file(_CGROUP_V1_QUOTA))
+        period = int(_read_file(_CGROUP_V1_PERIOD))
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def available_cpus():
+    """
+    Returns the number of CPUs this process can run on,
+    which respects its CPU affinity mask and the CPU quota
+    of the container it's in (if any).
+    """
+    try:
+        num_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # the affinity mask is only available on some systems.
+        num_cpus = os.cpu_count() or 1
+
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        num_cpus = min(num_cpus, math.ceil(limit))
+
+    return max(1, num_cpus)
@@ -2,22 +2,33 @@ import os
 import sys
 import tempfile
 import time
-import pdf2image
 from PIL import Image, ImageDraw
 from reportlab.pdfgen import canvas
-from tsumego_pdf.draw_game.board_graphics import GRAY, DPI, draw_cover
+from tsumego_pdf.draw_game.board_graphics import (
+    GRAY,
+    DPI,
+    convert_to_color_mode,
+    draw_cover,
+)
+from tsumego_pdf.pdf_images import draw_image, encode_image
+from tsumego_pdf.pdf_layers import finish_layers
+from tsumego_pdf.pdf_pages import PageDrawing, draw_page_drawing
+from tsumego_pdf.trace import span
 
 _DRAW_PUNCH_HOLES = True  # only if printers spread is being used.
 _PUNCH_HOLE_RGB = GRAY
 _PUNCH_HOLE_RADIUS_IN = 1 / 64
 _PUNCH_HOLE_BEGIN_IN = 1 / 2
 _NUM_PUNCH_HOLES = 6
+_COVER = "cover"  # the slot of a booklet's cover when it's embedded.
 
 
 def pdf_to_images(pdf_path):
     """
     Returns a list of temporary image paths which are the pages of the given PDF.
     """
+    import pdf2image  # only needed here, so it's imported once it's used.
+
     images = pdf2image.convert_from_path(pdf_path)
 
     temp_files = []
@@ -69,159 +80,139 @@ def progress_bar(
     sys.stdout.write(print_end)
 
 
+def _draw_page(out_pdf, page, x, y, width, height):
+    """Draws a page that's either an EncodedImage or a PageDrawing."""
+    if isinstance(page, PageDrawing):
+        draw_page_drawing(out_pdf, page, x, y, width=width, height=height)
+    else:
+        draw_image(out_pdf, page, x, y, width=width, height=height)
+
+
+def _draw_on_spread(out_pdf, image, paste_x, paste_y, spread_h, scale):
+    """
+    Draws the page where it would be pasted on a spread image
+    with its top-left corner at (paste_x, paste_y) in pixels.
+    """
+    _draw_page(
+        out_pdf,
+        image,
+        paste_x * scale,
+        (spread_h - paste_y - image.height) * scale,
+        width=image.width * scale,
+        height=image.height * scale,
+    )
+
+
 def write_images_to_pdf(
-    paths: list,
+    pages: list,
     out_path: str,
     paper_size,  # 72 DPI
     verbose: bool,  # if True, prints progress bar.
 ):
+    """
+    Writes the pages (EncodedImages or PageDrawings) to a PDF
+    in the order they're given and returns the paths of the files written, which is just out_path.
+    The pages are only iterated over once, so they can be
+    a PageStream of pages that are still being laid out and rendered.
+    """
     start_time = time.time()
     out_pdf = canvas.Canvas(out_path, pagesize=paper_size)
 
-    with Image.open(paths[0]) as img:
-        img_w, img_h = img.size
-    scale_x = paper_size[0] / img_w
-    scale_y = paper_size[1] / img_h
-    scale = min(scale_x, scale_y)
-
-    out_w = img_w * scale
-    out_h = img_h * scale
+    # the number of pages is only needed for the progress bar.
+    num_pages = len(pages) if verbose else None
 
-    padding_x = (paper_size[0] - out_w) // 2
+    for i, page in enumerate(pages):
+        if i == 0:
+            img_w, img_h = page.size
+            scale_x = paper_size[0] / img_w
+            scale_y = paper_size[1] / img_h
+            scale = min(scale_x, scale_y)
 
-    num_pages = len(paths)
+            out_w = img_w * scale
+            out_h = img_h * scale
 
-    for i, path in enumerate(paths):
-        out_pdf.drawImage(path, padding_x, 0, width=out_w, height=out_h)
-        if i < len(paths) - 1:
+            padding_x = (paper_size[0] - out_w) // 2
+        else:
             out_pdf.showPage()
 
-        percent_done = (i + 1) / num_pages
-        elapsed = time.time() - start_time
-        avg_duration = elapsed / (i + 1)
-        remaining_processes = num_pages - (i + 1)
-        est = remaining_processes * avg_duration
+        with span("page", "write", page=i + 1):
+            _draw_page(out_pdf, page, padding_x, 0, width=out_w, height=out_h)
 
         if verbose:
+            percent_done = (i + 1) / num_pages
+            elapsed = time.time() - start_time
+            avg_duration = elapsed / (i + 1)
+            remaining_processes = num_pages - (i + 1)
+            est = remaining_processes * avg_duration
             progress_bar(percent_done, est, prefix="2) Save")
 
-    out_pdf.save()
+    with span("save", "write"):
+        finish_layers(out_pdf)
+        out_pdf.save()
+    return [out_path]
 
 
-def write_images_to_booklet_pdf(
-    paths: list,
-    out_path: str,
-    paper_size,  # 72 DPI
-    booklet_center_padding_in,
+def _slot_image(pages, slot, cover_image):
+    """Returns the page or cover that goes in the slot of a booklet."""
+    if slot is None:
+        return None
+    if slot is _COVER:
+        return cover_image
+    return pages[slot]
+
+
+def _arrange_booklet(
+    num_pages: int,
     printers_spread: bool,
-    booklet_cover: str,
+    has_cover: bool,
     embed_cover_in_signatures: bool,
-    num_signatures: int = 1,
-    verbose: bool = False,  # if True, prints progress bar.
+    num_signatures: int,
 ):
     """
-    Takes the given image paths and writes them to a booklet PDF.
-    It can also output multiple PDFs for bookbinding with multiple signatures.
-    """
-    start_time = time.time()
-
-    # copies paths.
-    img_paths = paths[:]
-
-    # gets image width and height in pixels.
-    img_w = int((paper_size[0] / 72) * DPI)
-    img_h = int((paper_size[1] / 72) * DPI)
-
-    """
-    Step 0) Generates resources.
-    """
-    temp_paths = []
-
-    # generates the image pasted on the spines of signatures
-    # to help in the process of bookbinding.
-    punch_hole_image = None
-    if _DRAW_PUNCH_HOLES:
-        punch_hole_image = Image.new("RGB", (256, 256), (255, 255, 255))
-        punch_draw = ImageDraw.Draw(punch_hole_image)
-        punch_draw.ellipse((2, 2, 254, 254), fill=_PUNCH_HOLE_RGB)
-        punch_hole_dim = int(_PUNCH_HOLE_RADIUS_IN * DPI * 2)
-        punch_hole_image = punch_hole_image.resize(
-            (int(punch_hole_dim), int(punch_hole_dim)),
-            Image.Resampling.LANCZOS,
-        )
-        start_y = _PUNCH_HOLE_BEGIN_IN * DPI
-        spacing_y = (img_h - start_y * 2) / (_NUM_PUNCH_HOLES - 1)
-        holes_y = [start_y + i * spacing_y for i in range(_NUM_PUNCH_HOLES)]
-
-    # generates the image that's pasted on blank pages
-    # so that the printer doesn't ignore them when printing.
-    # (some printers will skip entirely blank pages).
-    dummy_image = Image.new("RGB", (30, 30), (255, 255, 255))
-    dummy_draw = ImageDraw.Draw(dummy_image)
-    dummy_draw.ellipse((2, 2, 28, 28), fill=(245, 245, 245))
-
-    dummy_image = dummy_image.resize(
-        (int(10), int(10)),
-        Image.Resampling.LANCZOS,
-    )
-
-    with tempfile.NamedTemporaryFile(suffix=".png") as temp_file:
-        dummy_temp_path = temp_file.name
-
-    dummy_image.save(dummy_temp_path)
-    temp_paths.append(dummy_temp_path)
-
+    Returns (slots, render_order, cover_directly_embedded) for a booklet,
+    where slots has the index of the page in each page position of the papers
+    (or _COVER or None if it's blank) and render_order has
+    (left_position, right_position, signature_i) for each side of the papers.
     """
-    Step 1) Creates cover page.
-    """
-    cover_path = None
-    if booklet_cover is not None:
-        # draws cover.
-        cover_image = draw_cover(img_w, img_h, booklet_cover)
-        with tempfile.NamedTemporaryFile(suffix=".png") as temp_file:
-            temp_path = temp_file.name
-        cover_image.save(temp_path)
-        temp_paths.append(temp_path)
-        cover_path = temp_path
-
     """
     Step 2) Embeds the cover page and back page directly in the first/last
             signatures if specified to do so.
     """
+    slots = list(range(num_pages))
     cover_directly_embedded = False
     if (
         embed_cover_in_signatures
         and printers_spread
-        and booklet_cover is not None
+        and has_cover
         and num_signatures > 1
     ):
-        img_paths = [cover_path, None] + img_paths[:]
+        slots = [_COVER, None] + slots
         cover_directly_embedded = True
 
     """
     Step 3) Determine the number of needed papers 
             and adds necessary blank pages.
     """
-    count = len(img_paths)
+    count = len(slots)
     papers_needed = (count - 1) // 4 + 1
     num_total_pages = papers_needed * 4
     needed_blank_pages = num_total_pages - count
 
     # inserts blank pages.
     for _ in range(needed_blank_pages):
-        img_paths.append(None)
+        slots.append(None)
 
     if (
-        img_paths[-1] is not None
+        slots[-1] is not None
         and embed_cover_in_signatures
         and printers_spread
-        and booklet_cover is not None
+        and has_cover
         and num_signatures > 1
     ):
         # ensures the back page is blank
         # if the cover/back page is directly embedded.
-        img_paths.extend([None, None, None, None])
-        count = len(img_paths)
+        slots.extend([None, None, None, None])
+        count = len(slots)
         papers_needed = (count - 1) // 4 + 1
         num_total_pages = papers_needed * 4
         needed_blank_pages = num_total_pages - count
@@ -283,10 +274,129 @@ def write_images_to_booklet_pdf(
         for i in range(1, num_total_pages - 1, 2):
             render_order.append((i, i + 1, None))
 
-        if img_paths[num_total_pages - 1] is not None:
+        if slots[num_total_pages - 1] is not None:
             render_order[0] = (None, 0, None)
             render_order.append((num_total_pages - 1, None, None))
 
+
+    return slots, render_order, cover_directly_embedded
+
+
+def booklet_page_order(
+    num_pages: int,
+    printers_spread: bool,
+    has_cover: bool,
+    embed_cover_in_signatures: bool,
+    num_signatures: int = 1,
+):
+    """
+    Returns the indices of the pages in the order
+    write_images_to_booklet_pdf(...) puts them in the booklet.
+    """
+    slots, render_order, _ = _arrange_booklet(
+        num_pages,
+        printers_spread,
+        has_cover,
+        embed_cover_in_signatures,
+        num_signatures,
+    )
+    page_order = []
+    for left_element, right_element, _ in render_order:
+        for element in (left_element, right_element):
+            if element is not None and isinstance(slots[element], int):
+                page_order.append(slots[element])
+    return page_order
+
+
+def write_images_to_booklet_pdf(
+    pages: list,
+    out_path: str,
+    paper_size,  # 72 DPI
+    booklet_center_padding_in,
+    printers_spread: bool,
+    booklet_cover: str,
+    embed_cover_in_signatures: bool,
+    num_signatures: int = 1,
+    verbose: bool = False,  # if True, prints progress bar.
+    color_mode: str = None,
+):
+    """
+    Takes the given pages (EncodedImages or PageDrawings)
+    and writes them to a booklet PDF.
+    It can also output multiple PDFs for bookbinding with multiple signatures,
+    and returns the paths of all the files written.
+
+    The pages of each spread are placed side by side in the PDF,
+    so their pixels are never decoded and composited again.
+    Each page is taken from pages once, in the order of booklet_page_order(...),
+    so pages can be a PageStream of pages that are still being rendered
+    if the color_mode of the pages is given.
+    """
+    start_time = time.time()
+
+    # gets image width and height in pixels.
+    img_w = int((paper_size[0] / 72) * DPI)
+    img_h = int((paper_size[1] / 72) * DPI)
+
+    # the spreads use the same color mode the pages were rendered in.
+    if color_mode is None:
+        color_mode = next(p for p in pages if p is not None).mode
+
+    """
+    Step 0) Generates resources.
+    """
+    # generates the image pasted on the spines of signatures
+    # to help in the process of bookbinding.
+    punch_hole_image = None
+    if _DRAW_PUNCH_HOLES:
+        punch_hole_image = Image.new("RGB", (256, 256), (255, 255, 255))
+        punch_draw = ImageDraw.Draw(punch_hole_image)
+        punch_draw.ellipse((2, 2, 254, 254), fill=_PUNCH_HOLE_RGB)
+        punch_hole_dim = int(_PUNCH_HOLE_RADIUS_IN * DPI * 2)
+        punch_hole_image = punch_hole_image.resize(
+            (int(punch_hole_dim), int(punch_hole_dim)),
+            Image.Resampling.LANCZOS,
+        )
+        punch_hole_image = encode_image(
+            convert_to_color_mode(punch_hole_image, color_mode)
+        )
+        start_y = _PUNCH_HOLE_BEGIN_IN * DPI
+        spacing_y = (img_h - start_y * 2) / (_NUM_PUNCH_HOLES - 1)
+        holes_y = [start_y + i * spacing_y for i in range(_NUM_PUNCH_HOLES)]
+
+    # generates the image that's pasted on blank pages
+    # so that the printer doesn't ignore them when printing.
+    # (some printers will skip entirely blank pages).
+    dummy_image = Image.new("RGB", (30, 30), (255, 255, 255))
+    dummy_draw = ImageDraw.Draw(dummy_image)
+    dummy_draw.ellipse((2, 2, 28, 28), fill=(245, 245, 245))
+
+    dummy_image = dummy_image.resize(
+        (int(10), int(10)),
+        Image.Resampling.LANCZOS,
+    )
+    dummy_image = encode_image(dummy_image)
+
+    """
+    Step 1) Creates cover page.
+    """
+    cover_image = None
+    if booklet_cover is not None:
+        # draws cover.
+        cover_image = draw_cover(img_w, img_h, booklet_cover)
+        cover_image = encode_image(convert_to_color_mode(cover_image, color_mode))
+
+    """
+    Steps 2-4) Arranges the pages on the papers.
+    """
+    slots, render_order, cover_directly_embedded = _arrange_booklet(
+        len(pages),
+        printers_spread,
+        booklet_cover is not None,
+        embed_cover_in_signatures,
+        num_signatures,
+    )
+
     """
     Step 5) Opens PDF writers.
     """
@@ -296,17 +406,17 @@ def write_images_to_booklet_pdf(
         and num_signatures > 1
         and not embed_cover_in_signatures
     ):
-        cover_path = out_path[:-4] + "-cover.pdf"
-        out_pdf = canvas.Canvas(cover_path, pagesize=paper_size)
+        new_path = out_path[:-4] + "-cover.pdf"
     elif (
         printers_spread
         and num_signatures > 1
         and (booklet_cover is None or embed_cover_in_signatures)
     ):
         new_path = out_path[:-4] + f"-signature-0.pdf"
-        out_pdf = canvas.Canvas(new_path, pagesize=paper_size)
     else:
-        out_pdf = canvas.Canvas(out_path, pagesize=paper_size)
+        new_path = out_path
+    out_pdf = canvas.Canvas(new_path, pagesize=paper_size)
+    saved_paths = [new_path]
 
     scale_x = paper_size[0] / img_w
     scale_y = paper_size[1] / img_h
@@ -317,12 +427,13 @@ def write_images_to_booklet_pdf(
 
     # adds booklet cover.
     if booklet_cover is not None and not cover_directly_embedded:
-        out_pdf.drawImage(cover_path, out_w // 2, 0, width=out_w // 2, height=out_h)
+        draw_image(out_pdf, cover_image, out_w // 2, 0, width=out_w // 2, height=out_h)
         out_pdf.showPage()  # blank for double-sided cover.
 
         if printers_spread:
-            out_pdf.drawImage(
-                dummy_temp_path,
+            draw_image(
+                out_pdf,
+                dummy_image,
                 ((img_w / DPI * 72) * 0.5) + 5,
                 ((img_h / DPI * 72) * 0.5) - 5,
                 width=10,
@@ -332,6 +443,7 @@ def write_images_to_booklet_pdf(
                 out_pdf.save()
                 new_path = out_path[:-4] + f"-signature-0.pdf"
                 out_pdf = canvas.Canvas(new_path, pagesize=paper_size)
+                saved_paths.append(new_path)
 
             else:
                 out_pdf.showPage()
@@ -345,66 +457,65 @@ def write_images_to_booklet_pdf(
     for i, row in enumerate(render_order):
         left_element, right_element, signature_i = row
         if printers_spread and last_signature_i != signature_i and num_signatures > 1:
-            out_pdf.save()
+            with span("save", "impose", signature=last_signature_i):
+                finish_layers(out_pdf)
+                out_pdf.save()
             last_signature_i = signature_i
             new_path = out_path[:-4] + f"-signature-{signature_i}.pdf"
             out_pdf = canvas.Canvas(new_path, pagesize=paper_size)
+            saved_paths.append(new_path)
 
-        left_path = None if left_element is None else img_paths[left_element]
-        right_path = None if right_element is None else img_paths[right_element]
+        left_slot = None if left_element is None else slots[left_element]
+        right_slot = None if right_element is None else slots[right_element]
 
-        left_image = Image.open(left_path) if left_path is not None else None
-        right_image = Image.open(right_path) if right_path is not None else None
-
-        page_image = Image.new("RGB", (img_w, img_h), (255, 255, 255))
-
-        if not printers_spread and left_image is None and right_image is None:
+        if not printers_spread and left_slot is None and right_slot is None:
             # entirely blank pages are skipped for digital output.
             continue
 
-        if left_image is not None:
-            page_paste_x = int(
-                img_w / 2 - booklet_center_padding_in * DPI / 2 - left_image.size[0]
-            )
-            dpi_x = int(int(page_paste_x / DPI * 72) * (DPI / 72))
-            page_image.paste(left_image, (dpi_x, 0))
-
-        if right_image is not None:
-            if right_path == cover_path:
-                page_paste_x = img_w // 2
-            else:
-                page_paste_x = int(img_w / 2 + booklet_center_padding_in * DPI / 2)
+        left_image = _slot_image(pages, left_slot, cover_image)
+        right_image = _slot_image(pages, right_slot, cover_image)
 
-            dpi_x = int(int(page_paste_x / DPI * 72) * (DPI / 72))
-            page_image.paste(right_image, (dpi_x, 0))
+        with span("spread", "impose", spread=i, signature=signature_i):
+            if left_image is not None:
+                page_paste_x = int(
+                    img_w / 2 - booklet_center_padding_in * DPI / 2 - left_image.width
+                )
+                dpi_x = int(int(page_paste_x / DPI * 72) * (DPI / 72))
+                _draw_on_spread(out_pdf, left_image, dpi_x, 0, img_h, scale)
 
-        if left_image is None and right_image is None:
-            out_pdf.drawImage(
-                dummy_temp_path,
-                ((img_w / DPI * 72) * 0.5) + 5,
-                ((img_h / DPI * 72) * 0.5) - 5,
-                width=10,
-                height=10,
-            )
-
-        if _DRAW_PUNCH_HOLES and printers_spread and (
-            (i < len(render_order) - 1 and render_order[i + 1][2] != signature_i)
-            or i == len(render_order) - 1
-        ):
-            # draws punch holes for the center pages of each signature.
-            paste_x = int(img_w / 2 - punch_hole_image.size[0] / 2)
-            for hole_y in holes_y:
-                paste_y = int(hole_y - punch_hole_image.size[1] / 2)
-                page_image.paste(punch_hole_image, (paste_x, paste_y))
-
-        with tempfile.NamedTemporaryFile(suffix=".png") as temp_file:
-            temp_path = temp_file.name
-        page_image.save(temp_path)
-        temp_paths.append(temp_path)
-
-        out_pdf.drawImage(temp_path, 0, 0, width=out_w, height=out_h)
-        if i < len(render_order) - 1:
-            out_pdf.showPage()
+            if right_image is not None:
+                if right_slot is _COVER:
+                    page_paste_x = img_w // 2
+                else:
+                    page_paste_x = int(img_w / 2 + booklet_center_padding_in * DPI / 2)
+
+                dpi_x = int(int(page_paste_x / DPI * 72) * (DPI / 72))
+                _draw_on_spread(out_pdf, right_image, dpi_x, 0, img_h, scale)
+
+            if left_image is None and right_image is None:
+                draw_image(
+                    out_pdf,
+                    dummy_image,
+                    ((img_w / DPI * 72) * 0.5) + 5,
+                    ((img_h / DPI * 72) * 0.5) - 5,
+                    width=10,
+                    height=10,
+                )
+
+            if _DRAW_PUNCH_HOLES and printers_spread and (
+                (i < len(render_order) - 1 and render_order[i + 1][2] != signature_i)
+                or i == len(render_order) - 1
+            ):
+                # draws punch holes for the center pages of each signature.
+                paste_x = int(img_w / 2 - punch_hole_image.width / 2)
+                for hole_y in holes_y:
+                    paste_y = int(hole_y - punch_hole_image.height / 2)
+                    _draw_on_spread(
+                        out_pdf, punch_hole_image, paste_x, paste_y, img_h, scale
+                    )
+
+            if i < len(render_order) - 1:
+                out_pdf.showPage()
 
         # shows the user how much time is left to export the PDFs.
         percent_done = (i + 1) / num_pages
@@ -416,7 +527,7 @@ def write_images_to_booklet_pdf(
         if verbose:
             progress_bar(percent_done, est, prefix="2) Save")
 
-    out_pdf.save()
-
-    for path in temp_paths:
-        os.remove(path)
+    with span("save", "impose", signature=last_signature_i):
+        finish_layers(out_pdf)
+        out_pdf.save()
+    return saved_paths